@@ -1,12 +1,37 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
+import click
 import torch
-from transformers import AutoTokenizer, AutoModel
+from transformers import AutoTokenizer, AutoModel, AutoConfig
 import sqlite3
 import os
 import numpy as np
 import json
 from dotenv import load_dotenv
 import math
+import hashlib
+import hmac
+import copy
+import functools
+import signal
+import mmap
+import shutil
+from urllib.parse import quote
+import threading
+import queue
+import time
+import sys
+import bisect
+import logging
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from typing import NamedTuple
+
+# File locking for knowledge index writers; not available on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Load environment variables
 load_dotenv()
@@ -18,25 +43,1049 @@ DEBUG_MODE = os.getenv('DEBUG_MODE', 'False').lower() == 'true'
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'aar_clinics.db')
 KNOWLEDGE_PATH = os.getenv('KNOWLEDGE_PATH', 'medical_knowledge')
 
-# Initialize empty lists for knowledge base
-knowledge_texts = []
-knowledge_embeddings = []
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
 
-# Load BioBERT model with error handling
-try:
-    # BioBERT base model
-    model_name = "dmis-lab/biobert-base-cased-v1.1"
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    biobert_model = AutoModel.from_pretrained(model_name)
-    print("BioBERT model loaded successfully!")
-except Exception as e:
-    print(f"BioBERT model loading failed: {e}")
-    exit(1)
-
-# Move models to GPU if available
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-biobert_model = biobert_model.to(device)
-biobert_model.eval()
+# BioBERT is loaded on a background thread, so pages and /find-clinics serve
+# while it loads. PRELOAD_MODEL=true loads it at import instead (for gunicorn's
+# preload_app). WARMUP_BATCHES representative batches run before it is ready.
+PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', 'False').lower() == 'true'
+WARMUP_BATCHES = int(os.getenv('WARMUP_BATCHES', '3'))
+
+# Levelled logging; per-query debug messages are only formatted when LOG_LEVEL=DEBUG
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG' if DEBUG_MODE else 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s")
+logger = logging.getLogger("aar_chatbot")
+
+# Per-request sampling profiler: requests sending `X-Profile: 1` and the admin
+# token write a folded stack profile to PROFILE_DIR. Off without ADMIN_TOKEN.
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '2'))
+
+# Micro-batching for BioBERT: a lone text runs straight away; when others are
+# already queued, a batch runs as soon as it has EMBED_MAX_BATCH texts or the
+# oldest text has waited EMBED_MAX_WAIT_MS
+EMBED_MAX_BATCH = int(os.getenv('EMBED_MAX_BATCH', '16'))
+EMBED_MAX_WAIT_MS = float(os.getenv('EMBED_MAX_WAIT_MS', '5'))
+
+# Messages answered together by get_chatbot_responses / POST /chat/batch
+BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '64'))
+
+# Token limits: chat queries are short, so they are truncated much earlier than documents
+QUERY_MAX_TOKENS = int(os.getenv('QUERY_MAX_TOKENS', '64'))
+DOCUMENT_MAX_TOKENS = 512
+
+# Query cache: in-process LRU, optionally backed by a SQLite file shared by all workers
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '4096'))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', '86400'))
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', '')
+# Rows kept per cache in the SQLite file; expired rows and the oldest rows over
+# the limit are pruned every CACHE_DB_PRUNE_EVERY writes of a process
+CACHE_DB_MAX_ROWS = int(os.getenv('CACHE_DB_MAX_ROWS', '100000'))
+CACHE_DB_PRUNE_EVERY = int(os.getenv('CACHE_DB_PRUNE_EVERY', '256'))
+
+# Inference backend for query embeddings: torch (fp32), torch-int8 or onnx
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch').lower()
+ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH', os.path.join(KNOWLEDGE_PATH, 'biobert_pooled.onnx'))
+
+# Bytes of the clinics database each read connection may memory-map
+CLINIC_DB_MMAP_BYTES = int(os.getenv('CLINIC_DB_MMAP_BYTES', str(64 * 1024 * 1024)))
+
+# Size of the lat/lng grid cells used by the clinic spatial index
+CLINIC_GRID_DEGREES = float(os.getenv('CLINIC_GRID_DEGREES', '0.5'))
+MAX_CLINICS_PER_QUERY = 50
+
+# Knowledge bases with at least this many chunks are searched with the IVF
+# index built by `flask build-ann-index`, when there is one
+ANN_MIN_CHUNKS = int(os.getenv('ANN_MIN_CHUNKS', '50000'))
+# Inverted lists scanned per query; more lists trade speed for recall
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '32'))
+
+# Incremental knowledge updates are written as segments next to the index.
+# Writers compact them into the base index once there are KNOWLEDGE_MAX_SEGMENTS
+# segments or KNOWLEDGE_MAX_DELETED_FRACTION of the rows are deleted. Workers
+# check for a new segment generation, and for a reload requested through another
+# worker, on a background thread every KNOWLEDGE_REFRESH_SECONDS (0 = never).
+KNOWLEDGE_MAX_SEGMENTS = int(os.getenv('KNOWLEDGE_MAX_SEGMENTS', '16'))
+KNOWLEDGE_MAX_DELETED_FRACTION = float(os.getenv('KNOWLEDGE_MAX_DELETED_FRACTION', '0.2'))
+KNOWLEDGE_REFRESH_SECONDS = float(os.getenv('KNOWLEDGE_REFRESH_SECONDS', '5'))
+
+# Two-stage answering: the RETRIEVAL_CANDIDATES closest knowledge chunks and
+# keywords are retrieved together, then RERANKER_MODEL (an optional cross-encoder
+# such as cross-encoder/ms-marco-MiniLM-L-6-v2) rescores them in one batch.
+# Queries whose reranking would not fit in RERANK_BUDGET_MS, or that arrive while
+# RERANK_MAX_CONCURRENCY reranks are running, are answered from the first stage.
+RETRIEVAL_CANDIDATES = int(os.getenv('RETRIEVAL_CANDIDATES', '8'))
+RERANKER_MODEL = os.getenv('RERANKER_MODEL', '')
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '50'))
+RERANK_MAX_CONCURRENCY = int(os.getenv('RERANK_MAX_CONCURRENCY', '2'))
+RERANK_MIN_SCORE = float(os.getenv('RERANK_MIN_SCORE', '0.5'))
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+# Exact cosine-similarity search over a fixed matrix of embeddings.
+# Rows are L2-normalized once at load time so a query is scored with a single
+# matmul, and top-k selection uses argpartition instead of a full sort.
+class RetrievalEngine:
+    # Upper bound on the number of scores materialized at once by search_batch
+    MAX_SCORES_PER_BLOCK = 1 << 24
+    # Rows of a float16 index converted to float32 at a time while scoring
+    HALF_PRECISION_ROWS_PER_BLOCK = 1 << 16
+
+    # Pre-normalized float32 or float16 embeddings (e.g. a read-only memmap) are
+    # used as they are, without a private copy
+    def __init__(self, embeddings, normalized=False):
+        embeddings = np.asarray(embeddings)
+        if embeddings.dtype not in (np.float32, np.float16):
+            embeddings = embeddings.astype(np.float32)
+        if embeddings.ndim != 2:
+            embeddings = embeddings.reshape(-1, embeddings.shape[-1]) if embeddings.size else np.empty((0, 0), dtype=np.float32)
+        if not normalized:
+            embeddings = self.normalize(embeddings)
+        if embeddings.flags.writeable:
+            embeddings.setflags(write=False)
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+    # Top-k (indices, scores) for a single query vector, best first
+    def search(self, query_embedding, top_k):
+        indices, scores = self.search_batch(np.asarray(query_embedding).reshape(1, -1), top_k)
+        return indices[0], scores[0]
+
+    # Top-k (indices, scores) for every row of a query matrix, best first.
+    # Rows set in the optional boolean deleted mask are never returned.
+    # Returns two (num_queries, k) arrays with k = min(top_k, live rows).
+    def search_batch(self, query_embeddings, top_k, deleted=None):
+        queries = self.normalize(np.atleast_2d(query_embeddings))
+        num_queries, num_rows = queries.shape[0], len(self)
+        k = min(top_k, num_rows - (int(np.count_nonzero(deleted)) if deleted is not None else 0))
+
+        indices = np.empty((num_queries, k), dtype=np.int64)
+        scores = np.empty((num_queries, k), dtype=np.float32)
+        if k == 0:
+            return indices, scores
+
+        # Score the queries in blocks so a large batch against a large index
+        # does not allocate one huge (queries x rows) matrix
+        block = max(1, self.MAX_SCORES_PER_BLOCK // num_rows)
+        for start in range(0, num_queries, block):
+            block_scores = self._scores(queries[start:start + block])
+            if deleted is not None:
+                block_scores[:, deleted] = -np.inf
+            if k < num_rows:
+                top = np.argpartition(block_scores, num_rows - k, axis=1)[:, num_rows - k:]
+            else:
+                top = np.broadcast_to(np.arange(num_rows), block_scores.shape)
+            top_scores = np.take_along_axis(block_scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            indices[start:start + block] = np.take_along_axis(top, order, axis=1)
+            scores[start:start + block] = np.take_along_axis(top_scores, order, axis=1)
+
+        return indices, scores
+
+    # Cosine scores of normalized queries against every row
+    def _scores(self, queries):
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        step = self.HALF_PRECISION_ROWS_PER_BLOCK
+        for start in range(0, len(self), step):
+            rows = self.embeddings[start:start + step].astype(np.float32)
+            scores[:, start:start + step] = queries @ rows.T
+        return scores
+
+# Approximate nearest neighbour search with an inverted file (IVF) index.
+# The rows are clustered around nlist k-means centroids; a query is only scored
+# exactly against the rows of its nprobe closest clusters. Same search and
+# search_batch interface as RetrievalEngine, over the same normalized rows.
+class IVFIndex:
+    # Rows assigned to centroids at a time while building; fewer for large
+    # nlist, so a block's (rows x nlist) scores stay within MAX_SCORES_PER_BLOCK
+    ASSIGN_ROWS_PER_BLOCK = 1 << 16
+
+    def __init__(self, embeddings, centroids, list_offsets, list_rows, nprobe=ANN_NPROBE):
+        self.embeddings = embeddings
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    # Top-k (indices, scores) for a single query vector, best first
+    def search(self, query_embedding, top_k, nprobe=None):
+        indices, scores = self.search_batch(np.asarray(query_embedding).reshape(1, -1), top_k, nprobe)
+        return indices[0], scores[0]
+
+    # Top-k (indices, scores) for every row of a query matrix, best first.
+    # Lists beyond nprobe are scanned when the probed ones hold fewer than k
+    # live rows. Rows set in the optional boolean deleted mask are never returned.
+    def search_batch(self, query_embeddings, top_k, nprobe=None, deleted=None):
+        queries = RetrievalEngine.normalize(np.atleast_2d(query_embeddings))
+        nprobe = max(1, nprobe or self.nprobe)
+        k = min(top_k, len(self) - (int(np.count_nonzero(deleted)) if deleted is not None else 0))
+
+        indices = np.empty((queries.shape[0], k), dtype=np.int64)
+        scores = np.empty((queries.shape[0], k), dtype=np.float32)
+        if k == 0:
+            return indices, scores
+
+        list_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        for i, query in enumerate(queries):
+            rows = self.candidates(list_order[i], nprobe, k, deleted)
+            row_scores = self.embeddings[rows].astype(np.float32) @ query
+            if deleted is not None:
+                row_scores[deleted[rows]] = -np.inf
+            top = np.argpartition(row_scores, len(rows) - k)[len(rows) - k:]
+            top = top[np.argsort(-row_scores[top])]
+            indices[i] = rows[top]
+            scores[i] = row_scores[top]
+
+        return indices, scores
+
+    # Sorted row ids in the first nprobe lists of list_order, with at least k live rows
+    def candidates(self, list_order, nprobe, k, deleted=None):
+        lists = []
+        found = 0
+        for probed, list_id in enumerate(list_order):
+            if probed >= nprobe and found >= k:
+                break
+            rows = self.list_rows[self.list_offsets[list_id]:self.list_offsets[list_id + 1]]
+            lists.append(rows)
+            found += len(rows) - (int(np.count_nonzero(deleted[rows])) if deleted is not None else 0)
+        # Sorted ids read the memory-mapped rows front to back
+        return np.sort(np.concatenate(lists))
+
+    # Spherical k-means over a sample of the rows, then every row is assigned to
+    # its closest centroid. Returns (centroids, list_offsets, list_rows).
+    @classmethod
+    def train(cls, embeddings, nlist, iterations=10, sample_size=None, seed=0):
+        rng = np.random.default_rng(seed)
+        num_rows = embeddings.shape[0]
+        nlist = max(1, min(nlist, num_rows))
+        sample_size = min(num_rows, sample_size or 64 * nlist)
+        sample = np.asarray(embeddings[np.sort(rng.choice(num_rows, sample_size, replace=False))], dtype=np.float32)
+
+        step = max(1, min(cls.ASSIGN_ROWS_PER_BLOCK, RetrievalEngine.MAX_SCORES_PER_BLOCK // nlist))
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)]
+        for _ in range(iterations):
+            sums = np.zeros_like(centroids)
+            counts = np.zeros(nlist, dtype=np.int64)
+            for start in range(0, sample_size, step):
+                block = sample[start:start + step]
+                assignment = cls.assign(block, centroids)
+                np.add.at(sums, assignment, block)
+                counts += np.bincount(assignment, minlength=nlist)
+            # Clusters that lost all their rows are reseeded from random sample rows
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = RetrievalEngine.normalize(sums)
+
+        assignment = np.concatenate([
+            cls.assign(embeddings[start:start + step], centroids)
+            for start in range(0, num_rows, step)
+        ])
+        list_rows = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))]).astype(np.int64)
+        return centroids, list_offsets, list_rows
+
+    # Closest centroid of every row
+    @staticmethod
+    def assign(rows, centroids):
+        return np.argmax(np.asarray(rows, dtype=np.float32) @ centroids.T, axis=1)
+
+# Knowledge texts stored back to back as UTF-8 in one file, with an offsets
+# array giving where each text starts. Both files are memory-mapped, so a text
+# is only read (and only paged in) when it is looked up by id, and every worker
+# shares the same pages through the OS cache.
+class TextStore:
+    def __init__(self, texts_file, offsets_file):
+        self.offsets = np.load(offsets_file, mmap_mode='r')
+        with open(texts_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("text id out of range")
+        return self._data[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    # Write texts to the store format, streaming; returns the number of texts
+    @staticmethod
+    def write(texts, texts_file, offsets_file, count):
+        offsets = np.lib.format.open_memmap(offsets_file + ".tmp", mode='w+', dtype=np.int64, shape=(count + 1,))
+        position = 0
+        written = 0
+        with open(texts_file + ".tmp", 'wb') as f:
+            for text in texts:
+                offsets[written] = position
+                data = text.encode("utf-8")
+                f.write(data)
+                position += len(data)
+                written += 1
+        offsets[written] = position
+        offsets.flush()
+        del offsets
+        os.replace(texts_file + ".tmp", texts_file)
+        os.replace(offsets_file + ".tmp", offsets_file)
+        return written
+
+# Several text stores (the base index and its segments) seen as one row space
+class SegmentedTextStore:
+    def __init__(self, stores, deleted=None):
+        self.stores = list(stores)
+        self.starts = np.cumsum([0] + [len(store) for store in self.stores])
+        self.deleted = [set(rows) for rows in deleted] if deleted is not None else [set() for _ in self.stores]
+        self.row_count = int(self.starts[-1])
+
+    # Number of live texts; deleted rows still take up row ids, see row_count
+    def __len__(self):
+        return self.row_count - sum(len(rows) for rows in self.deleted)
+
+    # Text of a row id from SegmentedIndex, which counts deleted rows too
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.row_count
+        if not 0 <= i < self.row_count:
+            raise IndexError("text id out of range")
+        part = bisect.bisect_right(self.starts, i) - 1
+        return self.stores[part][i - int(self.starts[part])]
+
+    # Live texts, in row order
+    def __iter__(self):
+        for store, deleted in zip(self.stores, self.deleted):
+            for row, text in enumerate(store):
+                if row not in deleted:
+                    yield text
+
+# Search over the base index and its segments as one row space. Each part is
+# (index, deleted row ids); each part scores with its deleted rows masked out,
+# and the per-part top-k results are merged. Same search and search_batch
+# interface as RetrievalEngine.
+class SegmentedIndex:
+    def __init__(self, parts):
+        self.parts = []
+        for index, deleted in parts:
+            mask = None
+            if len(deleted):
+                mask = np.zeros(len(index), dtype=bool)
+                mask[np.asarray(deleted, dtype=np.int64)] = True
+            self.parts.append((index, mask))
+        self.starts = np.cumsum([0] + [len(index) for index, _ in self.parts])
+        self.live_count = int(self.starts[-1]) - sum(int(np.count_nonzero(mask)) for _, mask in self.parts if mask is not None)
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    # Top-k (indices, scores) for a single query vector, best first
+    def search(self, query_embedding, top_k):
+        indices, scores = self.search_batch(np.asarray(query_embedding).reshape(1, -1), top_k)
+        return indices[0], scores[0]
+
+    # Top-k (indices, scores) for every row of a query matrix, best first,
+    # with k = min(top_k, live rows)
+    def search_batch(self, query_embeddings, top_k):
+        queries = RetrievalEngine.normalize(np.atleast_2d(query_embeddings))
+        k = min(top_k, self.live_count)
+        part_indices = []
+        part_scores = []
+        for (index, deleted), start in zip(self.parts, self.starts):
+            indices, scores = index.search_batch(queries, top_k, deleted=deleted)
+            part_indices.append(indices + start)
+            part_scores.append(scores)
+        indices = np.concatenate(part_indices, axis=1)
+        scores = np.concatenate(part_scores, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+# An answer candidate from the first retrieval stage
+class Candidate(NamedTuple):
+    kind: str  # "knowledge" or "keyword"
+    text: str  # the knowledge chunk or the keyword
+    score: float  # cosine similarity to the query
+
+    # Text the answer is built from, which the reranker scores against the query
+    @property
+    def passage(self):
+        return self.text if self.kind == "knowledge" else medical_responses[self.text]
+
+# Knowledge chunks and medical_responses keywords searched together as one row
+# space, knowledge rows first, so a query needs a single candidate search
+class CandidateIndex:
+    def __init__(self, knowledge_texts, knowledge_index, keywords, keyword_index):
+        self.knowledge_texts = knowledge_texts
+        self.keywords = keywords
+        self.knowledge_rows = len(knowledge_index)
+        self.index = SegmentedIndex([(knowledge_index, []), (keyword_index, [])])
+
+    # Top-k candidates for every row of a query matrix, best first
+    def search_batch(self, query_embeddings, top_k):
+        indices, scores = self.index.search_batch(query_embeddings, top_k)
+        return [[self.candidate(int(i), float(score)) for i, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in zip(indices, scores)]
+
+    def candidate(self, row, score):
+        if row < self.knowledge_rows:
+            return Candidate("knowledge", self.knowledge_texts[row], score)
+        return Candidate("keyword", self.keywords[row - self.knowledge_rows], score)
+
+# Two-tier cache keyed on normalized query text.
+# Tier 1 is an in-process LRU with size and TTL eviction. Tier 2 is an optional
+# SQLite table shared between worker processes. Every entry records the version
+# it was computed for; a lookup with a different version is a miss, so bumping
+# the version invalidates both tiers at once. On disk, rows of different
+# versions live side by side, so workers on the old and the new version during a
+# rolling reload don't evict each other; old versions age out through the TTL
+# and the max_db_rows cap.
+class QueryCache:
+    def __init__(self, namespace, max_entries, ttl_seconds, db_path="", encode=None, decode=None,
+                 max_db_rows=CACHE_DB_MAX_ROWS, prune_every=CACHE_DB_PRUNE_EVERY):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.db_path = db_path
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.max_db_rows = max_db_rows
+        self.prune_every = max(prune_every, 1)
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+        # Metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_key(text):
+        return " ".join(text.lower().split())
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS query_cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                version TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                value BLOB NOT NULL,
+                PRIMARY KEY (namespace, key, version)
+            )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_query_cache_entries_expiry ON query_cache_entries (namespace, expires_at)")
+            self._local.conn = conn
+        return conn
+
+    # Cached value or None; local_only skips the SQLite tier, so the lookup never touches the disk
+    def get(self, text, version, local_only=False):
+        key = self.normalize_key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                del self._entries[key]
+
+        if local_only:
+            return None
+        if self.db_path:
+            try:
+                with metrics.timer("cache_db_read"):
+                    row = self._connection().execute(
+                        "SELECT value, expires_at FROM query_cache_entries WHERE namespace = ? AND key = ? AND version = ?",
+                        (self.namespace, key, version),
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("Query cache read failed: %s", e)
+                row = None
+            if row is not None and row[1] > now:
+                value = self.decode(row[0])
+                self._store(key, version, row[1], value)
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, text, version, value):
+        key = self.normalize_key(text)
+        expires_at = time.time() + self.ttl
+        self._store(key, version, expires_at, value)
+
+        if self.db_path:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO query_cache_entries (namespace, key, version, expires_at, value) VALUES (?, ?, ?, ?, ?)",
+                        (self.namespace, key, version, expires_at, self.encode(value)),
+                    )
+                with self._lock:
+                    self._writes += 1
+                    prune = self._writes % self.prune_every == 0
+                if prune:
+                    self.prune()
+            except sqlite3.Error as e:
+                logger.warning("Query cache write failed: %s", e)
+
+    # Delete expired rows, then the rows closest to expiry beyond max_db_rows
+    def prune(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM query_cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, time.time()))
+            conn.execute(
+                "DELETE FROM query_cache_entries WHERE namespace = ? AND rowid IN ("
+                "SELECT rowid FROM query_cache_entries WHERE namespace = ? ORDER BY expires_at DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_db_rows),
+            )
+
+    def _store(self, key, version, expires_at, value):
+        with self._lock:
+            self._entries[key] = (version, expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop the in-process tier. With a version, also delete that version's rows
+    # on disk; rows of other versions may still be current for other workers.
+    def invalidate(self, version=None):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path and version is not None:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.execute("DELETE FROM query_cache_entries WHERE namespace = ? AND version = ?", (self.namespace, version))
+            except sqlite3.Error as e:
+                logger.warning("Query cache cleanup failed: %s", e)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "shared_store": bool(self.db_path),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+# Aho-Corasick multi-pattern matcher for the direct keyword stage.
+# Finds every keyword occurring in a query in a single pass over the query,
+# independent of the number of keywords. Matching is case-insensitive and only
+# counts hits on word boundaries, so "flu" does not fire inside "influenza".
+class KeywordMatcher:
+    # Endings still accepted after a keyword, so "headaches" and "coughing" match
+    INFLECTION_SUFFIXES = ("s", "es", "ing", "ed")
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self._lengths = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        # Build the trie
+        for i, keyword in enumerate(self.keywords):
+            pattern = keyword.lower()
+            self._lengths.append(len(pattern))
+            node = 0
+            for ch in pattern:
+                child = self._goto[node].get(ch)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][ch] = child
+                node = child
+            self._output[node].append(i)
+
+        # Breadth-first pass to add failure links and merge their outputs
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, child in self._goto[node].items():
+                pending.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _ends_word(self, text, end):
+        if end == len(text) or not text[end].isalnum():
+            return True
+        for suffix in self.INFLECTION_SUFFIXES:
+            stop = end + len(suffix)
+            if text.startswith(suffix, end) and (stop == len(text) or not text[stop].isalnum()):
+                return True
+        return False
+
+    # Yield (start, end, keyword) for every word-boundary keyword hit in text
+    def find_all(self, text):
+        text = text.lower()
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for i in self._output[node]:
+                end = pos + 1
+                start = end - self._lengths[i]
+                if (start == 0 or not text[start - 1].isalnum()) and self._ends_word(text, end):
+                    yield start, end, self.keywords[i]
+
+    # The most specific keyword in text: the longest hit, earliest on ties
+    def best_match(self, text):
+        best = None
+        for start, end, keyword in self.find_all(text):
+            if best is None or (end - start, -start) > (best[1] - best[0], -best[0]):
+                best = (start, end, keyword)
+        return best[2] if best else None
+
+# A row of the clinics table. __slots__ keeps thousands of these small.
+class Clinic:
+    __slots__ = ("id", "name", "address", "lat", "lng", "phone")
+
+    def __init__(self, id, name, address, lat, lng, phone):
+        self.id = id
+        self.name = name
+        self.address = address
+        self.lat = lat
+        self.lng = lng
+        self.phone = phone
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Clinic(id={self.id!r}, name={self.name!r})"
+
+# Read path for the clinics database.
+# Each thread gets one read-only connection that is reused for every query,
+# with memory-mapped I/O enabled and sqlite3's statement cache doing the
+# statement preparation once per connection. Writes stay in setup_database().
+# The database is in WAL mode, so even read-only connections create the -wal
+# and -shm files: the directory holding it must be writable.
+class ClinicStore:
+    SELECT_CLINICS = "SELECT id, name, address, lat, lng, phone FROM clinics"
+
+    def __init__(self, db_path, mmap_bytes=CLINIC_DB_MMAP_BYTES):
+        self.db_path = db_path
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+
+    # Per-thread connection; reopened after a fork since connections can't be shared across processes
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, cached_statements=32)
+            conn.execute(f"PRAGMA mmap_size = {int(self.mmap_bytes)}")
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _query(self, sql, params=()):
+        with metrics.timer("db_read"):
+            return [Clinic(*row) for row in self._connection().execute(sql, params)]
+
+    def all(self):
+        return self._query(self.SELECT_CLINICS + " ORDER BY id")
+
+    def get(self, clinic_id):
+        rows = self._query(self.SELECT_CLINICS + " WHERE id = ?", (clinic_id,))
+        return rows[0] if rows else None
+
+    # Clinics inside a lat/lng box, by id; uses the (lat, lng) index
+    def in_bbox(self, min_lat, max_lat, min_lng, max_lng):
+        return self._query(
+            self.SELECT_CLINICS + " WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ? ORDER BY id",
+            (min_lat, max_lat, min_lng, max_lng),
+        )
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+# Vectorized Haversine distance in km from one point to arrays of points (degrees)
+def haversine_distances(lat, lng, lats, lngs):
+    lat_rad = math.radians(lat)
+    lats_rad = np.radians(lats)
+    dlat = lats_rad - lat_rad
+    dlng = np.radians(lngs) - math.radians(lng)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat_rad) * np.cos(lats_rad) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+# In-memory spatial index over the clinics table.
+# Coordinates are kept as NumPy arrays and clinics are bucketed into a regular
+# lat/lng grid, so nearest and radius queries only compute distances for
+# clinics in cells around the user instead of the whole table.
+class ClinicIndex:
+    def __init__(self, clinics, cell_degrees=CLINIC_GRID_DEGREES):
+        self.clinics = tuple(clinics)
+        self.cell_degrees = cell_degrees
+        self.lats = np.array([clinic.lat for clinic in self.clinics], dtype=np.float64)
+        self.lngs = np.array([clinic.lng for clinic in self.clinics], dtype=np.float64)
+        self.num_rows = int(math.ceil(180.0 / cell_degrees))
+        self.num_cols = int(math.ceil(360.0 / cell_degrees))
+
+        cells = {}
+        for i, (lat, lng) in enumerate(zip(self.lats, self.lngs)):
+            cells.setdefault(self._cell(lat, lng), []).append(i)
+        self.cells = {cell: np.array(ids, dtype=np.int64) for cell, ids in cells.items()}
+
+    def __len__(self):
+        return len(self.clinics)
+
+    def _cell(self, lat, lng):
+        row = min(int((lat + 90.0) // self.cell_degrees), self.num_rows - 1)
+        col = int(((lng + 180.0) % 360.0) // self.cell_degrees) % self.num_cols
+        return row, col
+
+    # Clinic ids in all cells whose row and column lie within the given ranges
+    def _ids_in_cells(self, rows, cols):
+        found = []
+        for row in rows:
+            if 0 <= row < self.num_rows:
+                for col in cols:
+                    ids = self.cells.get((row, col % self.num_cols))
+                    if ids is not None:
+                        found.append(ids)
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    # Ids of clinics in the ring of cells exactly `ring` cells away from (row, col)
+    def _ids_in_ring(self, row, col, ring):
+        if ring == 0:
+            return self._ids_in_cells([row], [col])
+        found = [
+            self._ids_in_cells([row - ring, row + ring], range(col - ring, col + ring + 1)),
+            self._ids_in_cells(range(row - ring + 1, row + ring), [col - ring, col + ring]),
+        ]
+        return np.concatenate(found)
+
+    # Lower bound on the distance to any clinic outside the first `ring` rings
+    def _ring_clearance_km(self, lat, ring):
+        worst_lat = min(abs(lat) + (ring + 1) * self.cell_degrees, 90.0)
+        return ring * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(worst_lat))
+
+    def _results(self, ids, distances):
+        order = np.argsort(distances, kind="stable")
+        return [(self.clinics[ids[i]], float(distances[i])) for i in order]
+
+    # The k closest clinics as (clinic, distance_km), closest first
+    def nearest(self, lat, lng, k, max_km=None):
+        if max_km is not None:
+            return self.within(lat, lng, max_km)[:k]
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+
+        row, col = self._cell(lat, lng)
+        max_ring = max(self.num_rows, self.num_cols // 2)
+        ids = np.empty(0, dtype=np.int64)
+        distances = np.empty(0, dtype=np.float64)
+        for ring in range(max_ring + 1):
+            if 8 * ring > len(self.cells):
+                # Walking this ring would cost more than scanning every clinic
+                ids = np.arange(len(self))
+                distances = haversine_distances(lat, lng, self.lats, self.lngs)
+                break
+            ring_ids = self._ids_in_ring(row, col, ring)
+            if len(ring_ids):
+                ids = np.concatenate([ids, ring_ids])
+                distances = np.concatenate([distances, haversine_distances(lat, lng, self.lats[ring_ids], self.lngs[ring_ids])])
+            # Stop once nothing outside the scanned rings can beat the kth best
+            if len(ids) >= k:
+                kth = np.partition(distances, k - 1)[k - 1]
+                if kth <= self._ring_clearance_km(lat, ring):
+                    break
+
+        # Rings can wrap around the antimeridian and revisit cells
+        ids, first = np.unique(ids, return_index=True)
+        distances = distances[first]
+        if len(ids) > k:
+            top = np.argpartition(distances, k - 1)[:k]
+            ids, distances = ids[top], distances[top]
+        return self._results(ids, distances)
+
+    # All clinics within max_km as (clinic, distance_km), closest first
+    def within(self, lat, lng, max_km):
+        if max_km <= 0 or not len(self):
+            return []
+        lat_span = max_km / KM_PER_DEGREE
+        worst_lat = abs(lat) + lat_span
+        if worst_lat >= 90.0:
+            lng_span = 180.0
+        else:
+            lng_span = min(180.0, lat_span / math.cos(math.radians(worst_lat)))
+
+        first_row, first_col = self._cell(lat - lat_span, lng - lng_span)
+        last_row, last_col = self._cell(lat + lat_span, lng + lng_span)
+        if last_col < first_col or lng_span >= 180.0:
+            last_col += self.num_cols
+        cols = range(first_col, min(last_col, first_col + self.num_cols - 1) + 1)
+
+        ids = self._ids_in_cells(range(first_row, last_row + 1), cols)
+        distances = haversine_distances(lat, lng, self.lats[ids], self.lngs[ids])
+        keep = distances <= max_km
+        return self._results(ids[keep], distances[keep])
+
+# Everything loaded from disk at startup. Built once per worker and never mutated;
+# a reload builds a fresh AppState and swaps the reference in one assignment.
+class AppState(NamedTuple):
+    knowledge_texts: TextStore
+    knowledge_index: RetrievalEngine
+    knowledge_parts: tuple  # KnowledgePart per segment, reused when a new generation is picked up
+    knowledge_generation: int
+    knowledge_version: str  # base source hash and segment generation
+    reload_generation: int  # RELOAD_FILE generation this state was built for
+    keyword_index_keywords: tuple
+    keyword_index: RetrievalEngine
+    keyword_matcher: KeywordMatcher
+    candidate_index: CandidateIndex
+    clinic_index: ClinicIndex
+    cache_version: str  # changes whenever the knowledge base or medical_responses change
+
+# One immutable piece of the knowledge index: the base index built by
+# `flask build-index`, or a segment written by an incremental update.
+# deleted_rows maps the names of earlier parts to the rows this part deletes.
+class KnowledgePart(NamedTuple):
+    name: str
+    texts: TextStore
+    index: RetrievalEngine
+    deleted_rows: dict
+
+app_state = None
+app_state_lock = threading.Lock()
+
+# BioBERT base model, or EMBEDDING_MODEL: another BERT-style model name or
+# local directory, such as the small stand-in the benchmarks run offline with
+model_name = os.getenv('EMBEDDING_MODEL', "dmis-lab/biobert-base-cased-v1.1")
+
+# Set by load_model(); None until the model has been loaded
+tokenizer = None
+biobert_model = None
+device = None
+reference_backend = None
+embedding_backend = None
+reranker = None
+model_lock = threading.Lock()
+
+# Set once the model is loaded and warmed up; model_error holds why it failed
+model_ready = threading.Event()
+model_error = None
+model_loader = None
+model_loader_lock = threading.Lock()
+
+# BioBERT with the mean pooling from get_embedding folded into the forward pass,
+# so every backend (and the exported ONNX graph) returns pooled embeddings directly
+class MeanPooledEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)
+        token_embeddings = outputs.last_hidden_state
+        input_mask_expanded = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+        sum_embeddings = torch.sum(token_embeddings * input_mask_expanded, 1)
+        sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+        return sum_embeddings / sum_mask
+
+# PyTorch backend: the fp32 model as loaded, or a dynamically int8-quantized copy
+class TorchEmbeddingBackend:
+    def __init__(self, model, quantize=False):
+        if quantize:
+            # Dynamic quantization only runs on CPU; quantize a copy so the fp32 model is untouched
+            encoder = MeanPooledEncoder(copy.deepcopy(model).cpu()).eval()
+            self.encoder = torch.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+            self.device = torch.device("cpu")
+        else:
+            self.encoder = MeanPooledEncoder(model).eval()
+            self.device = device
+        self.name = "torch-int8" if quantize else "torch"
+
+    def embed(self, inputs):
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            return self.encoder(**inputs).cpu().numpy()
+
+# ONNX Runtime backend running the exported MeanPooledEncoder graph on CPU
+class OnnxEmbeddingBackend:
+    name = "onnx"
+
+    def __init__(self, onnx_path):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+    def embed(self, inputs):
+        feed = {k: v.cpu().numpy() for k, v in inputs.items() if k in self.input_names}
+        return self.session.run(None, feed)[0]
+
+# Cross-encoder scoring (query, passage) pairs jointly, for the second stage of
+# answering. Keeps a moving average of its cost per pair to stay within the
+# latency budget, and a slot per concurrent rerank to back off under load.
+class CrossEncoderReranker:
+    def __init__(self, reranker_name):
+        from transformers import AutoModelForSequenceClassification
+        self.name = reranker_name
+        self.tokenizer = AutoTokenizer.from_pretrained(reranker_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(reranker_name).to(device).eval()
+        self.slots = threading.BoundedSemaphore(max(RERANK_MAX_CONCURRENCY, 1))
+        self.seconds_per_pair = 0.0
+
+    # Relevance of each (query, passage) pair in [0, 1]
+    def score(self, pairs):
+        started = time.perf_counter()
+        inputs = self.tokenizer([query for query, _ in pairs], [passage for _, passage in pairs],
+                                truncation=True, max_length=DOCUMENT_MAX_TOKENS, padding=True, return_tensors="pt")
+        with torch.no_grad():
+            logits = self.model(**{k: v.to(device) for k, v in inputs.items()}).logits.float()
+        # Single-logit models score relevance directly; otherwise the last label is "relevant"
+        scores = torch.sigmoid(logits[:, 0]) if logits.shape[-1] == 1 else torch.softmax(logits, dim=-1)[:, -1]
+        self.record(len(pairs), time.perf_counter() - started)
+        return scores.cpu().numpy()
+
+    def record(self, pairs, seconds):
+        per_pair = seconds / max(pairs, 1)
+        self.seconds_per_pair = per_pair if not self.seconds_per_pair else 0.8 * self.seconds_per_pair + 0.2 * per_pair
+
+    # Number of pairs expected to fit in a budget. Every call that doesn't fit
+    # lowers the estimate a little, so a stale estimate from a slow moment is retried.
+    def pairs_within(self, budget_seconds, wanted):
+        if not self.seconds_per_pair:
+            return wanted
+        fit = int(budget_seconds / self.seconds_per_pair)
+        if fit < wanted:
+            self.seconds_per_pair *= 0.95
+        return min(fit, wanted)
+
+# Function to load the RERANKER_MODEL cross-encoder, once per process. Reranking
+# is optional, so a reranker that fails to load only disables it.
+def load_reranker():
+    global reranker
+    if not RERANKER_MODEL or reranker is not None:
+        return
+    try:
+        started = time.perf_counter()
+        reranker = CrossEncoderReranker(RERANKER_MODEL)
+        logger.info("Reranker %s loaded in %.1fs", RERANKER_MODEL, time.perf_counter() - started)
+    except Exception as e:
+        logger.exception("Reranker %s could not be loaded, reranking is disabled: %s", RERANKER_MODEL, e)
+
+# Function to export BioBERT with fused mean pooling to an ONNX file. The file is
+# written under a temporary name and renamed into place, so it is never seen half-written.
+def export_onnx_model(onnx_path):
+    encoder = MeanPooledEncoder(AutoModel.from_pretrained(model_name)).eval()
+    example = AutoTokenizer.from_pretrained(model_name)(["fever and headache", "chest pain"], return_tensors="pt", padding=True)
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in example]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["embedding"] = {0: "batch"}
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            tuple(example[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["embedding"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    os.replace(tmp_path, onnx_path)
+    logger.info("Exported ONNX model to %s", onnx_path)
+
+# Function to create an embedding backend by name
+def create_embedding_backend(name):
+    if name == "torch":
+        return TorchEmbeddingBackend(biobert_model)
+    if name == "torch-int8":
+        return TorchEmbeddingBackend(biobert_model, quantize=True)
+    if name == "onnx":
+        # Exported offline only: workers exporting at once would race on the file
+        if not os.path.exists(ONNX_MODEL_PATH):
+            raise RuntimeError(f"No ONNX model at {ONNX_MODEL_PATH}, run `flask export-onnx` first.")
+        return OnnxEmbeddingBackend(ONNX_MODEL_PATH)
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+# Function to load BioBERT and the embedding backends, once per process.
+# The fp32 backend builds the stored indexes; EMBEDDING_BACKEND serves queries.
+def load_model():
+    global tokenizer, biobert_model, device, reference_backend, embedding_backend
+    if embedding_backend is not None:
+        return
+    with model_lock:
+        if embedding_backend is not None:
+            return
+        started = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        
+        # Move models to GPU if available
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        biobert_model = model.to(device)
+        biobert_model.eval()
+        logger.info("BioBERT model loaded successfully in %.1fs", time.perf_counter() - started)
+        
+        reference_backend = TorchEmbeddingBackend(biobert_model)
+        embedding_backend = reference_backend if EMBEDDING_BACKEND == "torch" else create_embedding_backend(EMBEDDING_BACKEND)
+        logger.info("Using %s embedding backend", embedding_backend.name)
+
+# Embedding size of the configured model; read from its config, so it is known
+# before the weights are loaded
+@functools.lru_cache(maxsize=None)
+def model_dim():
+    if biobert_model is not None:
+        return biobert_model.config.hidden_size
+    return AutoConfig.from_pretrained(model_name).hidden_size
+
+# Query embeddings differ between backends, so cached ones are versioned by both
+EMBEDDING_CACHE_VERSION = f"{model_name}:{EMBEDDING_BACKEND}"
 
 # Medical responses dictionary )
 medical_responses = {
@@ -44,25 +1093,15 @@ medical_responses = {
 
       "nausea": "Nausea is the uncomfortable feeling of needing to vomit, often accompanied by dizziness, sweating, or stomach discomfort. It can be caused by various factors, including food poisoning, motion sickness, pregnancy, migraines, infections, or medications. Treatment depends on the cause but may include rest, hydration, or anti-nausea medications. Would you like to visit one of our clinics for further assesment?",
 
-  "headache": "A headache is pain or discomfort in the head or face, ranging from mild to severe. Common types include tension headaches (stress-related), migraines (often with nausea and light sensitivity), and cluster headaches (intense pain on one side). Causes may include dehydration, stress, lack of sleep, or underlying conditions. Pain relievers and rest often help.Would you like to visit one of our clinics for further assesment?",
-
   "fatigue": "Fatigue is extreme tiredness or lack of energy that doesn’t improve with rest. It can result from physical exertion, poor sleep, stress, anemia, thyroid disorders, chronic illnesses, or mental health conditions like depression. Managing fatigue involves addressing the underlying cause, improving sleep, and maintaining a balanced diet. Would you like to visit one of our clinics for further assesment?",
 
   "dizziness": "Dizziness is a sensation of lightheadedness, unsteadiness, or feeling faint. It can be caused by dehydration, low blood pressure, inner ear problems, anxiety, or neurological conditions. If dizziness is severe or persistent, medical evaluation is recommended to rule out serious causes. Would you like to visit one of our clinics for further assesment?",
 
-    "fever": "Fever is a temporary increase in body temperature, often due to an infection or illness. A normal fever (up to 100.4°F or 38°C) helps fight infections, but high fevers (above 102°F or 39°C) may require medical attention. Symptoms include chills, sweating, and body aches. Rest, hydration, and fever-reducing medications can help. Would you like to visit one of our clinics for further assesment?",
-
-  "cough": "A cough is a reflex to clear irritants or mucus from the airways. It can be dry (no mucus) or productive (with phlegm). Causes include colds, flu, allergies, asthma, or infections like bronchitis. Persistent coughs (lasting weeks) should be evaluated by a doctor. Would you like to visit one of our clinics for further assesment?",
-
     "constipation": "Constipation is difficulty passing stools or infrequent bowel movements, often due to low fiber intake, dehydration, or lack of exercise. Increasing fiber, water, and physical activity can help. Chronic constipation may require medical evaluation. Would you like to visit one of our clinics for further assesment?",
 
-  "chest pain": "Chest pain can range from mild discomfort to severe pressure and may stem from heart, lung, digestive, or muscle issues. While some causes (like heartburn) are minor, sudden or severe chest pain (especially with shortness of breath) requires immediate medical attention to rule out heart attack or other serious conditions. Would you like to visit one of our clinics for further assesment?",
-
 
   "back pain": "Back pain is discomfort in the upper, middle, or lower back, often due to muscle strain, poor posture, herniated discs, or arthritis. Most cases improve with rest, gentle stretching, and pain relievers. Chronic or severe pain with numbness/weakness may need medical evaluation. Would you like to visit one of our clinics for further assesment?",
 
-  "diarrhea": "Diarrhea is frequent, loose, or watery bowel movements, often caused by infections (viral, bacterial), food intolerance, or digestive disorders. It can lead to dehydration, so drinking fluids with electrolytes is important. If severe or lasting more than 2 days, medical advice is recommended. Would you like to visit one of our clinics for further assesment?",
-
 
     "malaria": "Malaria is caused by a parasite transmitted through mosquito bites. Common symptoms include fever, chills, sweating, headache, nausea, and body aches. In severe cases, it may cause yellow skin (jaundice), seizures, or coma. Immediate medical attention is crucial. We recommend visiting an AAR clinic for a blood test and treatment. Would you like help finding the nearest AAR clinic?",
     
@@ -98,8 +1137,6 @@ medical_responses = {
 
     "emergency": "For life-threatening emergencies (e.g., severe chest pain, heavy bleeding, or difficulty breathing), call emergency services immediately. For urgent but non-critical issues, AAR clinics provide fast care. Would you like me to find the nearest AAR clinic?",
     
-    "yeast infection": "Yeast infections are common fungal infections that cause itching, burning, and abnormal discharge, typically in the genital area. They can result from antibiotics, hormonal changes, or weakened immunity. AAR clinics provide confidential diagnosis and treatment options. Would you like help finding a nearby AAR clinic?",
-    
     "rash": "Rashes can be caused by allergies, infections, heat, or skin conditions. Symptoms include redness, itching, bumps, or blisters. If a rash is severe, spreading rapidly, or accompanied by fever, seek medical care. AAR clinics can diagnose and treat various skin conditions. Would you like help finding an AAR clinic?",
     
     "urinary tract infection": "UTIs cause painful urination, frequency, urgency, and sometimes blood in urine. Fever or back pain may indicate a kidney infection requiring immediate care. AAR clinics provide testing and antibiotics for UTIs. Would you like me to help you find the nearest AAR clinic?",
@@ -108,8 +1145,6 @@ medical_responses = {
     
     "diarrhea": "Diarrhea can result from infections, food poisoning, medications, or digestive disorders. Stay hydrated and seek care if it persists over 2 days, contains blood, or causes severe dehydration. AAR clinics can diagnose the cause and provide treatment. Would you like me to locate an AAR clinic near you?",
     
-    "pregnancy": "If you think you might be pregnant or have confirmed a pregnancy, regular prenatal care is essential. AAR clinics offer pregnancy testing, prenatal checkups, and guidance throughout your pregnancy journey. Would you like help finding an AAR clinic for maternal care?",
-    
     "pregnant": "If you think you might be pregnant or have confirmed a pregnancy, regular prenatal care is essential. AAR clinics offer pregnancy testing, prenatal checkups, and guidance throughout your pregnancy journey. Would you like help finding an AAR clinic for maternal care?",
 
     "vaccination": "Vaccinations are crucial for preventing serious diseases. AAR clinics provide various vaccines for all age groups, including routine childhood immunizations, flu shots, travel vaccines, and COVID-19 vaccines. Would you like me to help you find an AAR clinic for vaccination services?",
@@ -208,44 +1243,740 @@ expanded_knowledge = [
     "Psoriasis is a chronic skin condition that speeds up the life cycle of skin cells, causing them to build up rapidly on the surface of the skin. The extra skin cells form scales and red patches that are often itchy and sometimes painful. It's thought to be an immune system problem and can be triggered by infections, stress, and cold weather."
 ]
 
-# Function to set up the knowledge base
+# Files making up a finished knowledge index, written by `flask build-index`.
+# Format 3: normalized embeddings, texts in an offset-indexed binary file, and
+# the chunks' content hashes as fixed-width bytes next to them rather than in
+# the manifest, which every worker parses at startup.
+KNOWLEDGE_INDEX_FORMAT = 3
+KNOWLEDGE_TEXTS_FILE = "knowledge_texts.bin"
+KNOWLEDGE_OFFSETS_FILE = "knowledge_offsets.npy"
+KNOWLEDGE_EMBEDDINGS_FILE = "knowledge_embeddings.npy"
+KNOWLEDGE_CONTENT_HASHES_FILE = "knowledge_content_hashes.npy"
+KNOWLEDGE_MANIFEST_FILE = "manifest.json"
+KNOWLEDGE_CHECKPOINT_FILE = "build_checkpoint.json"
+# IVF index files, written next to the embeddings by `flask build-ann-index`
+KNOWLEDGE_IVF_CENTROIDS_FILE = "knowledge_ivf_centroids.npy"
+KNOWLEDGE_IVF_OFFSETS_FILE = "knowledge_ivf_offsets.npy"
+KNOWLEDGE_IVF_ROWS_FILE = "knowledge_ivf_rows.npy"
+# Incremental updates: segments/<name>/ hold the same texts, offsets and
+# embeddings files plus segment.json; segments.json lists the live segments and
+# its generation goes up with every write, which is what workers watch for
+KNOWLEDGE_SEGMENTS_FILE = "segments.json"
+KNOWLEDGE_SEGMENTS_DIR = "segments"
+KNOWLEDGE_SEGMENT_META_FILE = "segment.json"
+KNOWLEDGE_WRITE_LOCK_FILE = ".write.lock"
+# Bumped by /admin/reload and SIGHUP; every worker reloads when it changes.
+# It has its own lock, so a reload never waits for a knowledge write to finish.
+RELOAD_FILE = "reload.json"
+RELOAD_LOCK_FILE = ".reload.lock"
+BASE_KNOWLEDGE_PART = "base"
+
+def knowledge_file_path(name, knowledge_path=None):
+    return os.path.join(knowledge_path or KNOWLEDGE_PATH, name)
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Write JSON to a temp file and rename it into place so readers never see half a file
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+# Save an array to a temp file and rename it into place, so a worker that has
+# the old file memory-mapped keeps reading the old contents
+def save_npy_atomic(path, array):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+# Function to save content hashes as a fixed-width bytes array, returns the file name for the manifest
+def save_content_hashes(content_hashes, knowledge_path=None):
+    save_npy_atomic(knowledge_file_path(KNOWLEDGE_CONTENT_HASHES_FILE, knowledge_path),
+                    np.array(content_hashes, dtype="S64"))
+    return KNOWLEDGE_CONTENT_HASHES_FILE
+
+# Function to read the content hashes of the base index, in row order
+def load_content_hashes(manifest, knowledge_path=None):
+    hashes = np.load(knowledge_file_path(manifest["content_hashes_file"], knowledge_path))
+    return [content_hash.decode("ascii") for content_hash in hashes]
+
+# Function to read the manifest of the knowledge index, None if there isn't one
+def load_knowledge_manifest(knowledge_path=None):
+    manifest_file = knowledge_file_path(KNOWLEDGE_MANIFEST_FILE, knowledge_path)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+# Function to set up the knowledge base, returns (texts, embeddings, manifest).
+# Only opens an index finished by `flask build-index`; the web app never embeds
+# the knowledge base itself. Texts and embeddings are memory-mapped read-only,
+# so worker processes share them instead of each holding a private copy.
 def setup_knowledge_base():
-    global knowledge_texts, knowledge_embeddings
-    
-    # Create directory if it doesn't exist
+    knowledge_file = knowledge_file_path(KNOWLEDGE_TEXTS_FILE)
+    offsets_file = knowledge_file_path(KNOWLEDGE_OFFSETS_FILE)
+    embeddings_file = knowledge_file_path(KNOWLEDGE_EMBEDDINGS_FILE)
+    manifest = load_knowledge_manifest()
+    empty = ([], np.empty((0, 0), dtype=np.float32), None)
+    
+    if manifest is None or not manifest.get("complete"):
+        logger.warning("No finished knowledge index in %s, run `flask build-index`. Knowledge retrieval is disabled.", KNOWLEDGE_PATH)
+        return empty
+    if manifest.get("format") != KNOWLEDGE_INDEX_FORMAT:
+        logger.warning("Knowledge index in %s uses an old format, run `flask build-index`. Knowledge retrieval is disabled.", KNOWLEDGE_PATH)
+        return empty
+    if manifest["model_name"] != model_name:
+        logger.warning("Knowledge index was built with %s, not %s. Knowledge retrieval is disabled.", manifest["model_name"], model_name)
+        return empty
+    if manifest["dim"] != model_dim():
+        # Same model name but a different model (e.g. another local directory):
+        # every search would fail, so don't start at all
+        raise RuntimeError(f"Knowledge index in {KNOWLEDGE_PATH} has {manifest['dim']}-dimensional embeddings, but "
+                           f"{model_name} produces {model_dim()}-dimensional ones. Rebuild it with `flask build-index`.")
+    
+    # Open existing knowledge and embeddings
+    knowledge_texts = TextStore(knowledge_file, offsets_file)
+    knowledge_embeddings = np.load(embeddings_file, mmap_mode='r')
+    
+    if knowledge_embeddings.shape != (manifest["count"], manifest["dim"]) or len(knowledge_texts) != manifest["count"]:
+        logger.warning("Knowledge index in %s does not match its manifest. Knowledge retrieval is disabled.", KNOWLEDGE_PATH)
+        return empty
+    
+    logger.info("Opened %d knowledge chunks (%s) from disk", len(knowledge_texts), knowledge_embeddings.dtype)
+    return knowledge_texts, knowledge_embeddings, manifest
+
+# Stream knowledge texts from a JSONL file, one {"text": ...} object or JSON string per line.
+# Without a source file the built-in expanded_knowledge list is used.
+def iter_knowledge_source(source=None):
+    if source is None:
+        yield from expanded_knowledge
+        return
+    with open(source, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record if isinstance(record, str) else record.get("text")
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError(f"{source}:{line_number}: expected a JSON string or an object with a \"text\" field")
+            yield text
+
+# Function to embed a knowledge source into KNOWLEDGE_PATH in batches.
+# Embeddings are L2-normalized and written straight into a memory-mapped .npy
+# file (float32, or float16 to halve its size) and progress is checkpointed
+# after every batch, so an interrupted build resumes where it stopped.
+# The manifest is written last and marks the index as finished.
+def build_knowledge_index(source=None, batch_size=32, knowledge_path=None, restart=False, dtype="float32"):
+    knowledge_path = knowledge_path or KNOWLEDGE_PATH
+    os.makedirs(knowledge_path, exist_ok=True)
+    
+    # First pass: count the chunks and hash their content
+    content_hashes = [text_hash(text) for text in iter_knowledge_source(source)]
+    count = len(content_hashes)
+    source_hash = hashlib.sha256("".join(content_hashes).encode("utf-8")).hexdigest()
+    load_model()
+    dim = biobert_model.config.hidden_size
+    
+    partial_file = knowledge_file_path(KNOWLEDGE_EMBEDDINGS_FILE + ".partial", knowledge_path)
+    checkpoint_file = knowledge_file_path(KNOWLEDGE_CHECKPOINT_FILE, knowledge_path)
+    build_key = {"source_hash": source_hash, "model_name": model_name, "count": count, "dim": dim, "dtype": dtype}
+    
+    rows_done = 0
+    if not restart and os.path.exists(checkpoint_file) and os.path.exists(partial_file):
+        with open(checkpoint_file, 'r') as f:
+            checkpoint = json.load(f)
+        if all(checkpoint.get(key) == value for key, value in build_key.items()):
+            rows_done = checkpoint["rows_done"]
+            logger.info("Resuming knowledge index build at chunk %d of %d", rows_done, count)
+    
+    if rows_done:
+        embeddings = np.lib.format.open_memmap(partial_file, mode='r+')
+    else:
+        embeddings = np.lib.format.open_memmap(partial_file, mode='w+', dtype=dtype, shape=(count, dim))
+    
+    # Second pass: embed the chunks that are not done yet
+    batch = []
+    position = 0
+    started = time.perf_counter()
+    
+    def flush(embeddings, batch, start):
+        embeddings[start:start + len(batch)] = RetrievalEngine.normalize(embed_batch(batch, reference_backend, max_batch_size=batch_size))
+        embeddings.flush()
+        write_json_atomic(checkpoint_file, dict(build_key, rows_done=start + len(batch)))
+        logger.info("Embedded %d/%d knowledge chunks", start + len(batch), count)
+    
+    for text in iter_knowledge_source(source):
+        if position >= rows_done:
+            batch.append(text)
+            if len(batch) == batch_size:
+                flush(embeddings, batch, position - len(batch) + 1)
+                batch = []
+        position += 1
+    if batch:
+        flush(embeddings, batch, position - len(batch))
+    
+    embeddings.flush()
+    del embeddings
+    
+    # Publish the finished index: move the new files into place, then swap in
+    # the manifest last, so a crash part way leaves the old manifest rather than
+    # none. Workers reopen the base index once the segment list below is reset.
+    # The new index replaces any incremental segments.
+    with knowledge_write_lock(knowledge_path):
+        TextStore.write(
+            iter_knowledge_source(source),
+            knowledge_file_path(KNOWLEDGE_TEXTS_FILE, knowledge_path),
+            knowledge_file_path(KNOWLEDGE_OFFSETS_FILE, knowledge_path),
+            count,
+        )
+        os.replace(partial_file, knowledge_file_path(KNOWLEDGE_EMBEDDINGS_FILE, knowledge_path))
+        content_hashes_file = save_content_hashes(content_hashes, knowledge_path)
+        write_json_atomic(knowledge_file_path(KNOWLEDGE_MANIFEST_FILE, knowledge_path), {
+            "complete": True,
+            "format": KNOWLEDGE_INDEX_FORMAT,
+            "model_name": model_name,
+            "dim": dim,
+            "count": count,
+            "dtype": dtype,
+            "normalized": True,
+            "source_hash": source_hash,
+            "content_hashes_file": content_hashes_file,
+        })
+        reset_knowledge_segments(source_hash, knowledge_source_label(source), knowledge_path)
+        os.remove(checkpoint_file)
+    
+    logger.info("Built knowledge index with %d chunks in %.1fs", count, time.perf_counter() - started)
+    return count
+
+# Function to build the IVF index of a finished knowledge index and record it in
+# the manifest. nlist defaults to 4 * sqrt(chunks).
+def build_ann_index(knowledge_path=None, nlist=None, iterations=10, sample_size=None):
+    manifest = load_knowledge_manifest(knowledge_path)
+    if manifest is None or not manifest.get("complete"):
+        raise click.ClickException("No finished knowledge index, run `flask build-index` first.")
+    
+    started = time.perf_counter()
+    embeddings = np.load(knowledge_file_path(KNOWLEDGE_EMBEDDINGS_FILE, knowledge_path), mmap_mode='r')
+    nlist = nlist or max(1, int(4 * math.sqrt(len(embeddings))))
+    centroids, list_offsets, list_rows = IVFIndex.train(embeddings, nlist, iterations, sample_size)
+    
+    save_npy_atomic(knowledge_file_path(KNOWLEDGE_IVF_CENTROIDS_FILE, knowledge_path), centroids)
+    save_npy_atomic(knowledge_file_path(KNOWLEDGE_IVF_OFFSETS_FILE, knowledge_path), list_offsets)
+    save_npy_atomic(knowledge_file_path(KNOWLEDGE_IVF_ROWS_FILE, knowledge_path), list_rows)
+    # The source hash ties the IVF files to these embeddings; a rebuilt index
+    # writes a new manifest without this entry
+    manifest["ann"] = {"type": "ivf", "nlist": len(centroids), "source_hash": manifest["source_hash"]}
+    write_json_atomic(knowledge_file_path(KNOWLEDGE_MANIFEST_FILE, knowledge_path), manifest)
+    
+    logger.info("Built IVF index with %d lists over %d chunks in %.1fs", len(centroids), len(embeddings), time.perf_counter() - started)
+    return len(centroids)
+
+# Function to open the IVF index recorded in the manifest, None if there isn't one
+def load_ann_index(knowledge_embeddings, manifest, knowledge_path=None):
+    ann = manifest.get("ann") if manifest else None
+    if not ann or ann.get("type") != "ivf" or ann.get("source_hash") != manifest["source_hash"]:
+        return None
+    index = IVFIndex(
+        knowledge_embeddings,
+        np.load(knowledge_file_path(KNOWLEDGE_IVF_CENTROIDS_FILE, knowledge_path)),
+        np.load(knowledge_file_path(KNOWLEDGE_IVF_OFFSETS_FILE, knowledge_path), mmap_mode='r'),
+        np.load(knowledge_file_path(KNOWLEDGE_IVF_ROWS_FILE, knowledge_path), mmap_mode='r'),
+    )
+    if index.list_offsets[-1] != len(knowledge_embeddings):
+        logger.warning("IVF index in %s does not match the knowledge index, run `flask build-ann-index`.", knowledge_path or KNOWLEDGE_PATH)
+        return None
+    return index
+
+# Function to pick the knowledge search: the IVF index for large knowledge
+# bases when one was built, exact search otherwise
+def create_knowledge_index(knowledge_embeddings, manifest):
+    if manifest and manifest["count"] >= ANN_MIN_CHUNKS:
+        index = load_ann_index(knowledge_embeddings, manifest)
+        if index is not None:
+            logger.info("Using IVF index with %d lists, nprobe=%d", len(index.centroids), index.nprobe)
+            return index
+        logger.warning("Knowledge index has %d chunks but no IVF index, run `flask build-ann-index`. Using exact search.", manifest["count"])
+    return RetrievalEngine(knowledge_embeddings, normalized=bool(manifest and manifest.get("normalized")))
+
+# Name recorded for a knowledge source, so the built-in list can be checked for changes
+def knowledge_source_label(source=None):
+    return os.path.abspath(source) if source else "built-in"
+
+# Hold the knowledge index write lock, so builds, segment writes and compactions
+# run one at a time. Without fcntl (Windows) writers are not serialized.
+@contextmanager
+def knowledge_write_lock(knowledge_path=None, lock_name=KNOWLEDGE_WRITE_LOCK_FILE):
+    os.makedirs(knowledge_path or KNOWLEDGE_PATH, exist_ok=True)
+    with open(knowledge_file_path(lock_name, knowledge_path), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+# Function to read the segment list; a list left over from an older base index is ignored
+def load_knowledge_segments(manifest=None, knowledge_path=None):
+    segments_file = knowledge_file_path(KNOWLEDGE_SEGMENTS_FILE, knowledge_path)
+    segments = {"generation": 0, "base_source_hash": None, "source": None, "segments": []}
+    if os.path.exists(segments_file):
+        with open(segments_file, 'r') as f:
+            segments.update(json.load(f))
+    if manifest is not None and segments["base_source_hash"] != manifest["source_hash"]:
+        segments = dict(segments, base_source_hash=manifest["source_hash"], segments=[])
+    return segments
+
+# Function to start a new, empty segment list on top of a new base index and
+# remove the old segment directories
+def reset_knowledge_segments(base_source_hash, source=None, knowledge_path=None):
+    segments = load_knowledge_segments(knowledge_path=knowledge_path)
+    write_json_atomic(knowledge_file_path(KNOWLEDGE_SEGMENTS_FILE, knowledge_path), {
+        "generation": segments["generation"] + 1,
+        "base_source_hash": base_source_hash,
+        "source": source if source is not None else segments["source"],
+        "segments": [],
+    })
+    segments_dir = knowledge_file_path(KNOWLEDGE_SEGMENTS_DIR, knowledge_path)
+    if os.path.isdir(segments_dir):
+        shutil.rmtree(segments_dir)
+
+def knowledge_segment_path(name, knowledge_path=None):
+    return os.path.join(knowledge_file_path(KNOWLEDGE_SEGMENTS_DIR, knowledge_path), name)
+
+def load_segment_meta(name, knowledge_path=None):
+    with open(os.path.join(knowledge_segment_path(name, knowledge_path), KNOWLEDGE_SEGMENT_META_FILE), 'r') as f:
+        return json.load(f)
+
+# Function to open one segment as a KnowledgePart
+def open_knowledge_segment(name, knowledge_path=None):
+    segment_path = knowledge_segment_path(name, knowledge_path)
+    meta = load_segment_meta(name, knowledge_path)
+    texts = TextStore(os.path.join(segment_path, KNOWLEDGE_TEXTS_FILE), os.path.join(segment_path, KNOWLEDGE_OFFSETS_FILE))
+    if meta["count"]:
+        embeddings = np.load(os.path.join(segment_path, KNOWLEDGE_EMBEDDINGS_FILE), mmap_mode='r')
+    else:
+        embeddings = np.empty((0, 0), dtype=np.float32)
+    return KnowledgePart(name, texts, RetrievalEngine(embeddings, normalized=True), meta["deleted_rows"])
+
+# Function to open the knowledge index with its segments, returns the knowledge
+# fields of AppState. Parts of previous_state that are still live are reused,
+# so picking up a new generation only opens the new segments.
+def load_knowledge(previous_state=None):
+    segments = load_knowledge_segments()
+    previous_parts = {part.name: part for part in previous_state.knowledge_parts} if previous_state else {}
+    base = previous_parts.get(BASE_KNOWLEDGE_PART)
+    
+    if base is None or previous_state.knowledge_version.split(":")[0] != segments["base_source_hash"]:
+        knowledge_texts, knowledge_embeddings, manifest = setup_knowledge_base()
+        base = KnowledgePart(BASE_KNOWLEDGE_PART, knowledge_texts, create_knowledge_index(knowledge_embeddings, manifest), {})
+        if manifest is None:
+            return combine_knowledge_parts([base], 0, "")
+        segments = load_knowledge_segments(manifest)
+        check_built_in_knowledge(manifest, segments)
+        base_source_hash = manifest["source_hash"]
+    else:
+        base_source_hash = segments["base_source_hash"]
+    
+    parts = [base]
+    for name in segments["segments"]:
+        parts.append(previous_parts.get(name) or open_knowledge_segment(name))
+    return combine_knowledge_parts(parts, segments["generation"], base_source_hash)
+
+# Function to merge knowledge parts into the knowledge fields of AppState.
+# A part's rows are deleted by the tombstones of the parts after it.
+def combine_knowledge_parts(parts, generation, base_source_hash):
+    deleted = {part.name: set() for part in parts}
+    for part in parts:
+        for name, rows in part.deleted_rows.items():
+            deleted[name].update(rows)
+    
+    if len(parts) == 1 and not deleted[parts[0].name]:
+        knowledge_texts, knowledge_index = parts[0].texts, parts[0].index
+    else:
+        knowledge_texts = SegmentedTextStore([part.texts for part in parts], [deleted[part.name] for part in parts])
+        knowledge_index = SegmentedIndex((part.index, sorted(deleted[part.name])) for part in parts)
+    
+    return {
+        "knowledge_texts": knowledge_texts,
+        "knowledge_index": knowledge_index,
+        "knowledge_parts": tuple(parts),
+        "knowledge_generation": generation,
+        "knowledge_version": f"{base_source_hash}:{generation}",
+    }
+
+# Function to map every live chunk's content hash to its (part name, row)
+# locations, for writers. Reads the content hashes of the base and every segment.
+def knowledge_live_rows(manifest, segments, knowledge_path=None):
+    parts = [(BASE_KNOWLEDGE_PART, load_content_hashes(manifest, knowledge_path), {})]
+    for name in segments["segments"]:
+        meta = load_segment_meta(name, knowledge_path)
+        parts.append((name, meta["content_hashes"], meta["deleted_rows"]))
+    
+    deleted = set()
+    for _, _, deleted_rows in parts:
+        deleted.update((name, row) for name, rows in deleted_rows.items() for row in rows)
+    live = {}
+    for name, content_hashes, _ in parts:
+        for row, content_hash in enumerate(content_hashes):
+            if (name, row) not in deleted:
+                live.setdefault(content_hash, []).append((name, row))
+    return live
+
+# Warn when the built-in knowledge list no longer matches an index built from it
+def check_built_in_knowledge(manifest, segments, knowledge_path=None):
+    if segments.get("source") != "built-in":
+        return
+    live = knowledge_live_rows(manifest, segments, knowledge_path)
+    wanted = {text_hash(text) for text in expanded_knowledge}
+    added, removed = len(wanted - live.keys()), len(live.keys() - wanted)
+    if added or removed:
+        logger.warning("expanded_knowledge has %d new and %d removed chunks compared with the knowledge index, "
+                       "run `flask knowledge-sync`", added, removed)
+
+# Function to open a finished knowledge index for writing, returns (manifest, segments)
+def open_knowledge_for_update(knowledge_path=None):
+    manifest = load_knowledge_manifest(knowledge_path)
+    if manifest is None or not manifest.get("complete") or manifest.get("format") != KNOWLEDGE_INDEX_FORMAT:
+        raise click.ClickException("No finished knowledge index, run `flask build-index` first.")
+    if manifest["model_name"] != model_name:
+        raise click.ClickException(f"Knowledge index was built with {manifest['model_name']}, not {model_name}.")
+    if manifest["dim"] != model_dim():
+        raise click.ClickException(f"Knowledge index has {manifest['dim']}-dimensional embeddings, not {model_dim()}.")
+    return manifest, load_knowledge_segments(manifest, knowledge_path)
+
+# Function to apply an incremental update: texts whose content hash is not live
+# yet are embedded and appended, and every live row of the deleted content
+# hashes is tombstoned, all in one new segment. Only new texts are embedded.
+# Returns the new generation, or None if nothing changed.
+def update_knowledge(add_texts=(), delete_hashes=(), source=None, knowledge_path=None):
+    with knowledge_write_lock(knowledge_path):
+        manifest, segments = open_knowledge_for_update(knowledge_path)
+        live = knowledge_live_rows(manifest, segments, knowledge_path)
+        
+        delete_hashes = set(delete_hashes)
+        new_texts = {}
+        for text in add_texts:
+            content_hash = text_hash(text)
+            if content_hash not in live and content_hash not in delete_hashes:
+                new_texts.setdefault(content_hash, text)
+        deleted_rows = {}
+        for content_hash in delete_hashes:
+            for name, row in live.get(content_hash, []):
+                deleted_rows.setdefault(name, []).append(row)
+        if not new_texts and not deleted_rows:
+            logger.info("Knowledge index is already up to date")
+            return None
+        
+        generation = segments["generation"] + 1
+        name = f"segment-{generation:06d}"
+        segment_path = knowledge_segment_path(name, knowledge_path)
+        partial_path = segment_path + ".partial"
+        if os.path.isdir(partial_path):
+            shutil.rmtree(partial_path)
+        os.makedirs(partial_path)
+        
+        # Embed the new texts straight into the segment's memory-mapped embeddings
+        texts = list(new_texts.values())
+        if texts:
+            load_model()
+            embeddings = np.lib.format.open_memmap(os.path.join(partial_path, KNOWLEDGE_EMBEDDINGS_FILE), mode='w+',
+                                                   dtype=manifest["dtype"], shape=(len(texts), manifest["dim"]))
+            for start in range(0, len(texts), 256):
+                embeddings[start:start + 256] = RetrievalEngine.normalize(embed_batch(texts[start:start + 256], reference_backend))
+            embeddings.flush()
+            del embeddings
+        TextStore.write(texts, os.path.join(partial_path, KNOWLEDGE_TEXTS_FILE), os.path.join(partial_path, KNOWLEDGE_OFFSETS_FILE), len(texts))
+        write_json_atomic(os.path.join(partial_path, KNOWLEDGE_SEGMENT_META_FILE), {
+            "generation": generation,
+            "count": len(texts),
+            "content_hashes": list(new_texts),
+            "deleted_rows": {part: sorted(rows) for part, rows in deleted_rows.items()},
+        })
+        os.replace(partial_path, segment_path)
+        
+        # Publishing the new segment list is what makes workers pick the segment up
+        write_json_atomic(knowledge_file_path(KNOWLEDGE_SEGMENTS_FILE, knowledge_path), dict(
+            segments,
+            generation=generation,
+            source=source if source is not None else segments["source"],
+            segments=segments["segments"] + [name],
+        ))
+        logger.info("Wrote knowledge segment %s: %d chunks added, %d rows deleted",
+                    name, len(texts), sum(len(rows) for rows in deleted_rows.values()))
+        
+        # Compact once there are too many segments or too many deleted rows
+        total_rows = manifest["count"] + sum(load_segment_meta(segment, knowledge_path)["count"] for segment in segments["segments"]) + len(texts)
+        live_rows = sum(len(rows) for rows in live.values()) + len(texts) - sum(len(rows) for rows in deleted_rows.values())
+        if len(segments["segments"]) + 1 >= KNOWLEDGE_MAX_SEGMENTS or total_rows - live_rows > KNOWLEDGE_MAX_DELETED_FRACTION * total_rows:
+            return compact_knowledge_index(knowledge_path, locked=True)
+        return generation
+
+# Function to bring the knowledge index in line with a source: new chunks are
+# added and chunks no longer in the source are deleted, by content hash
+def sync_knowledge(source=None, knowledge_path=None):
+    texts = list(iter_knowledge_source(source))
+    with knowledge_write_lock(knowledge_path):
+        manifest, segments = open_knowledge_for_update(knowledge_path)
+        live = knowledge_live_rows(manifest, segments, knowledge_path)
+    wanted = {text_hash(text) for text in texts}
+    return update_knowledge(texts, live.keys() - wanted, source=knowledge_source_label(source), knowledge_path=knowledge_path)
+
+# Function to replace the content hashes of old_hash with new_text
+def replace_knowledge_chunk(old_hash, new_text, knowledge_path=None):
+    return update_knowledge([new_text], [old_hash], knowledge_path=knowledge_path)
+
+# Function to rewrite the base index with the live rows of the base and all
+# segments, without re-embedding anything, and start a new empty segment list
+def compact_knowledge_index(knowledge_path=None, locked=False):
+    if not locked:
+        with knowledge_write_lock(knowledge_path):
+            return compact_knowledge_index(knowledge_path, locked=True)
+    
+    started = time.perf_counter()
+    manifest, segments = open_knowledge_for_update(knowledge_path)
+    live = knowledge_live_rows(manifest, segments, knowledge_path)
+    
+    # Live rows of every part in order, with their content hashes
+    parts = [(BASE_KNOWLEDGE_PART, knowledge_path or KNOWLEDGE_PATH)]
+    parts += [(name, knowledge_segment_path(name, knowledge_path)) for name in segments["segments"]]
+    live_rows = {}
+    for content_hash, locations in live.items():
+        for name, row in locations:
+            live_rows.setdefault(name, []).append((row, content_hash))
+    
+    count = sum(len(rows) for rows in live_rows.values())
+    content_hashes = []
+    partial_file = knowledge_file_path(KNOWLEDGE_EMBEDDINGS_FILE + ".partial", knowledge_path)
+    embeddings = np.lib.format.open_memmap(partial_file, mode='w+', dtype=manifest["dtype"], shape=(count, manifest["dim"]))
+    position = 0
+    for name, path in parts:
+        rows = sorted(live_rows.get(name, []))
+        if not rows:
+            continue
+        part_embeddings = np.load(os.path.join(path, KNOWLEDGE_EMBEDDINGS_FILE), mmap_mode='r')
+        row_ids = np.array([row for row, _ in rows], dtype=np.int64)
+        for start in range(0, len(row_ids), 1 << 16):
+            block = row_ids[start:start + (1 << 16)]
+            embeddings[position:position + len(block)] = part_embeddings[block]
+            position += len(block)
+        content_hashes.extend(content_hash for _, content_hash in rows)
+    embeddings.flush()
+    del embeddings
+    
+    def live_texts():
+        for name, path in parts:
+            texts = TextStore(os.path.join(path, KNOWLEDGE_TEXTS_FILE), os.path.join(path, KNOWLEDGE_OFFSETS_FILE))
+            for row, _ in sorted(live_rows.get(name, [])):
+                yield texts[row]
+    
+    # The compacted texts go to a temporary store first, since the old base
+    # texts are still being read from
+    texts_file = knowledge_file_path(KNOWLEDGE_TEXTS_FILE + ".compact", knowledge_path)
+    offsets_file = knowledge_file_path(KNOWLEDGE_OFFSETS_FILE + ".compact", knowledge_path)
+    TextStore.write(live_texts(), texts_file, offsets_file, count)
+    
+    # Publish like build_knowledge_index does, with the manifest swapped in last
+    source_hash = hashlib.sha256("".join(content_hashes).encode("utf-8")).hexdigest()
+    os.replace(partial_file, knowledge_file_path(KNOWLEDGE_EMBEDDINGS_FILE, knowledge_path))
+    os.replace(texts_file, knowledge_file_path(KNOWLEDGE_TEXTS_FILE, knowledge_path))
+    os.replace(offsets_file, knowledge_file_path(KNOWLEDGE_OFFSETS_FILE, knowledge_path))
+    content_hashes_file = save_content_hashes(content_hashes, knowledge_path)
+    manifest = {key: value for key, value in manifest.items() if key != "ann"}
+    write_json_atomic(knowledge_file_path(KNOWLEDGE_MANIFEST_FILE, knowledge_path),
+                      dict(manifest, count=count, source_hash=source_hash, content_hashes_file=content_hashes_file))
+    if count >= ANN_MIN_CHUNKS:
+        build_ann_index(knowledge_path)
+    reset_knowledge_segments(source_hash, knowledge_path=knowledge_path)
+    
+    logger.info("Compacted the knowledge index to %d chunks in %.1fs", count, time.perf_counter() - started)
+    return segments["generation"] + 1
+
+# Hash of the medical_responses keywords and the model embedding them, used to detect a stale keyword index.
+# Only the keys are embedded, so editing a response text does not force a rebuild.
+def medical_responses_hash():
+    payload = json.dumps([model_name, model_dim(), list(medical_responses.keys())]).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+# Function to set up the keyword embedding index, returns (keywords, normalized embeddings).
+# `flask build-index` builds it; the web app loads it with build=False and uses
+# an empty index when it is missing or stale, since it never embeds it itself.
+def setup_keyword_index(build=True):
     if not os.path.exists(KNOWLEDGE_PATH):
         os.makedirs(KNOWLEDGE_PATH)
-        
-    # Check if we already have knowledge embeddings
-    knowledge_file = os.path.join(KNOWLEDGE_PATH, "knowledge_texts.json")
-    embeddings_file = os.path.join(KNOWLEDGE_PATH, "knowledge_embeddings.npy")
-    
-    if os.path.exists(knowledge_file) and os.path.exists(embeddings_file):
-        # Load existing knowledge and embeddings
-        with open(knowledge_file, 'r') as f:
-            knowledge_texts = json.load(f)
-        knowledge_embeddings = np.load(embeddings_file)
-        print(f"Loaded {len(knowledge_texts)} knowledge chunks from disk")
+
+    index_file = os.path.join(KNOWLEDGE_PATH, "keyword_embeddings.npz")
+    current_hash = medical_responses_hash()
+
+    if os.path.exists(index_file):
+        with np.load(index_file) as data:
+            if str(data["hash"]) == current_hash and data["embeddings"].shape[-1] == model_dim():
+                keywords = [str(k) for k in data["keywords"]]
+                embeddings = data["embeddings"]
+                logger.info("Loaded keyword index with %d keywords from disk", len(keywords))
+                return keywords, embeddings
+
+    if not build:
+        logger.warning("Keyword index in %s is missing or out of date, run `flask build-index`. Semantic keyword matching is disabled.", KNOWLEDGE_PATH)
+        return [], np.empty((0, 0), dtype=np.float32)
+
+    # Embed every keyword once and store the rows normalized so scoring is a single dot product
+    keywords = list(medical_responses.keys())
+    logger.info("Creating embeddings for keyword index...")
+    load_model()
+    embeddings = RetrievalEngine.normalize(embed_batch(keywords, reference_backend))
+
+    # Written under a per-process temp name and renamed, since several workers may rebuild it at once
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, hash=np.array(current_hash), keywords=np.array(keywords), embeddings=embeddings)
+    os.replace(tmp_file, index_file)
+
+    logger.info("Created keyword index with %d keywords", len(keywords))
+    return keywords, embeddings
+
+# Memory use of this process in MB. On Linux, Pss splits shared pages between
+# the processes mapping them, so it shows how much a worker really costs.
+def process_memory_mb():
+    try:
+        with open("/proc/self/smaps_rollup", 'r') as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line and not line.startswith(" "))
+        return {
+            name.lower(): int(fields[name].split()[0]) / 1024.0
+            for name in ("Rss", "Pss", "Shared_Clean", "Private_Dirty")
+            if name in fields
+        }
+    except OSError:
+        import resource
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {"max_rss": peak_kb / 1024.0}
+
+def format_memory(memory):
+    return ", ".join(f"{name}={value:.1f}MB" for name, value in memory.items())
+
+# Load everything the request handlers need into a new, read-only AppState
+def build_app_state():
+    setup_database()
+    reload_generation = read_reload_generation()
+    knowledge = load_knowledge()
+    keywords, keyword_embeddings = setup_keyword_index(build=False)
+    keyword_index = RetrievalEngine(keyword_embeddings, normalized=True)
+
+    return AppState(
+        **knowledge,
+        keyword_index_keywords=tuple(keywords),
+        keyword_index=keyword_index,
+        keyword_matcher=KeywordMatcher(medical_responses.keys()),
+        candidate_index=CandidateIndex(knowledge["knowledge_texts"], knowledge["knowledge_index"], tuple(keywords), keyword_index),
+        clinic_index=ClinicIndex(get_all_clinics()),
+        cache_version=response_cache_version(knowledge["knowledge_version"]),
+        reload_generation=reload_generation,
+    )
+
+# Cached responses are only valid for this exact knowledge base, response set and reranking setup
+def response_cache_version(knowledge_version):
+    return hashlib.sha256(
+        json.dumps([knowledge_version, medical_responses, RETRIEVAL_CANDIDATES, RERANKER_MODEL, RERANK_MIN_SCORE],
+                   sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+# Initialize the app state once per worker process
+def init_app_state():
+    global app_state
+    if app_state is not None:
+        return app_state
+    with app_state_lock:
+        if app_state is None:
+            memory_before = process_memory_mb()
+            app_state = build_app_state()
+            response_cache.invalidate()
+            logger.info("Worker %d initialized, memory before: %s, after: %s",
+                        os.getpid(), format_memory(memory_before), format_memory(process_memory_mb()))
+    start_model_loading()
+    start_state_refresher()
+    return app_state
+
+# Rebuild the app state from disk and swap it in atomically.
+# Requests already in flight keep using the state they started with.
+def reload_app_state():
+    global app_state
+    with app_state_lock:
+        new_state = build_app_state()
+        app_state = new_state
+    response_cache.invalidate()
+    logger.info("Reloaded app state: %d knowledge chunks, %d keywords",
+                knowledge_chunk_count(new_state), len(new_state.keyword_index_keywords))
+    return new_state
+
+# Reload generation in RELOAD_FILE, 0 before the first reload request
+def read_reload_generation():
+    reload_file = knowledge_file_path(RELOAD_FILE)
+    if not os.path.exists(reload_file):
+        return 0
+    with open(reload_file, 'r') as f:
+        return json.load(f)["generation"]
+
+# Ask every worker to reload: bump the shared reload generation, which the
+# other workers notice in refresh_app_state(), and reload this one right away
+def request_reload():
+    with knowledge_write_lock(lock_name=RELOAD_LOCK_FILE):
+        generation = read_reload_generation() + 1
+        write_json_atomic(knowledge_file_path(RELOAD_FILE), {"generation": generation})
+    logger.info("Requested reload generation %d", generation)
+    return reload_app_state()
+
+# Pick up a reload requested through another worker, or a new knowledge
+# segment generation written by another process. For a new segment generation
+# only the knowledge fields of the app state are swapped, reusing the parts
+# that are already open.
+def refresh_app_state():
+    global app_state
+    if app_state is None:
         return
-    
-    # If not, create embeddings for our expanded knowledge base
-    knowledge_texts = expanded_knowledge
-    knowledge_embeddings = []
-    
-    print("Creating embeddings for knowledge base...")
-    for text in knowledge_texts:
-        embedding = get_embedding(text)
-        knowledge_embeddings.append(embedding)
-    
-    # Convert to numpy array
-    knowledge_embeddings = np.array(knowledge_embeddings)
-    
-    # Save knowledge and embeddings
-    with open(knowledge_file, 'w') as f:
-        json.dump(knowledge_texts, f)
-    np.save(embeddings_file, knowledge_embeddings)
-    
-    print(f"Created knowledge base with {len(knowledge_texts)} entries")
+    try:
+        if read_reload_generation() != app_state.reload_generation:
+            reload_app_state()
+            return
+        if load_knowledge_segments()["generation"] == app_state.knowledge_generation:
+            return
+        with app_state_lock:
+            knowledge = load_knowledge(app_state)
+            new_state = app_state._replace(
+                **knowledge,
+                candidate_index=CandidateIndex(knowledge["knowledge_texts"], knowledge["knowledge_index"],
+                                               app_state.keyword_index_keywords, app_state.keyword_index),
+                cache_version=response_cache_version(knowledge["knowledge_version"]),
+            )
+            app_state = new_state
+        response_cache.invalidate()
+        logger.info("Picked up knowledge generation %d: %d parts, %d chunks",
+                    new_state.knowledge_generation, len(new_state.knowledge_parts), knowledge_chunk_count(new_state))
+    except Exception as e:
+        logger.exception("App state refresh failed: %s", e)
+
+# Every worker polls for changes on its own background thread, so requests
+# only ever read the app_state reference and never touch the disk for it
+state_refresher = None
+state_refresher_lock = threading.Lock()
+
+def refresh_app_state_periodically():
+    while True:
+        time.sleep(KNOWLEDGE_REFRESH_SECONDS)
+        refresh_app_state()
+
+# Start the refresh thread, once per worker process
+def start_state_refresher():
+    global state_refresher
+    if KNOWLEDGE_REFRESH_SECONDS <= 0:
+        return
+    with state_refresher_lock:
+        if state_refresher is None:
+            state_refresher = threading.Thread(target=refresh_app_state_periodically, name="state-refresher", daemon=True)
+            state_refresher.start()
+
+# Number of live knowledge chunks in an app state
+def knowledge_chunk_count(state):
+    return getattr(state.knowledge_index, "live_count", len(state.knowledge_index))
 
 # Database setup function
 def setup_database():
@@ -265,6 +1996,10 @@ def setup_database():
     )
     ''')
     
+    # Index for bounding-box lookups, and WAL so readers never block on a writer
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_clinics_lat_lng ON clinics (lat, lng)")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    
     # Insert sample data if table is empty
     cursor.execute("SELECT COUNT(*) FROM clinics")
     if cursor.fetchone()[0] == 0:
@@ -304,83 +2039,430 @@ def setup_database():
     conn.commit()
     conn.close()
 
+clinic_store = ClinicStore(DATABASE_PATH)
+
 def get_all_clinics():
     """Retrieve all clinics from database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM clinics")
-    clinics = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    return clinics
+    return clinic_store.all()
 
-# Function to calculate distance between two points using Haversine formula
-def calculate_distance(lat1, lng1, lat2, lng2):
-    # Earth's radius in kilometers
-    R = 6371.0
-    
-    # Convert latitude and longitude from degrees to radians
-    lat1_rad = math.radians(lat1)
-    lng1_rad = math.radians(lng1)
-    lat2_rad = math.radians(lat2)
-    lng2_rad = math.radians(lng2)
-    
-    # Differences in coordinates
-    dlat = lat2_rad - lat1_rad
-    dlng = lng2_rad - lng1_rad
-    
-    # Haversine formula
-    a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    distance = R * c
+# Coalesces concurrent get_embedding calls into padded batches.
+# Callers submit a text and get a Future back; a single background worker
+# collects up to max_batch_size texts, runs one forward pass and resolves the
+# futures. A text that arrives while the worker is idle and nothing else is
+# queued runs at once; only when more texts are pending does the worker wait up
+# to max_wait_ms after the first one for the batch to fill.
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, max_batch_size, max_wait_ms):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = Counter()
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+        self.total_compute_seconds = 0.0
+
+    def submit(self, text):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return future
+
+    # The worker is started lazily, and again after a fork, because threads
+    # do not survive into child processes
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        # No concurrent load: waiting would only add latency
+        if self._queue.empty():
+            return batch
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Skip requests whose caller already gave up
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                embeddings = self.embed_fn([text for text, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for (_, future, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.total_wait_seconds += sum(started - submitted for _, _, submitted in batch)
+            self.total_compute_seconds += finished - started
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "mean_queue_wait_ms": 1000.0 * self.total_wait_seconds / self.items if self.items else 0.0,
+            "mean_batch_compute_ms": 1000.0 * self.total_compute_seconds / self.batches if self.batches else 0.0,
+        }
+
+# Counts real and padded tokens going through the model, to show what
+# length bucketing and the query token cap save
+class TokenStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.forward_passes = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.seconds = 0.0
+
+    def record(self, tokens, padded_tokens, seconds):
+        with self._lock:
+            self.forward_passes += 1
+            self.tokens += tokens
+            self.padded_tokens += padded_tokens
+            self.seconds += seconds
+
+    def stats(self):
+        return {
+            "forward_passes": self.forward_passes,
+            "tokens": self.tokens,
+            "padded_tokens": self.padded_tokens,
+            "padding_ratio": 1.0 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0,
+            "tokens_per_second": self.tokens / self.seconds if self.seconds else 0.0,
+            "query_max_tokens": QUERY_MAX_TOKENS,
+        }
+
+token_stats = TokenStats()
+
+# Counters and histograms rendered in the Prometheus text format by /metrics.
+# Values are per worker process, like /stats. Collectors are callbacks that
+# read existing stats (cache hits, queue depth, ...) when /metrics is scraped.
+class Metrics:
+    LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> (kind, help, buckets)
+        self._values = {}  # name -> {labels: value, or [bucket counts..., sum, count]}
+        self._collectors = []  # (name, kind, help, fn returning [(labels dict, value)])
+
+    def describe(self, name, kind, help_text, buckets=LATENCY_BUCKETS):
+        self._metrics[name] = (kind, help_text, tuple(buckets))
+        self._values.setdefault(name, {})
+
+    def register_collector(self, name, kind, help_text, fn):
+        self._collectors.append((name, kind, help_text, fn))
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values[name]
+            values[key] = values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = self._metrics[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values[name]
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = values[key] = [0] * (len(buckets) + 1) + [0.0, 0]
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    # Time the body of a with block into the aar_stage_seconds histogram
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("aar_stage_seconds", time.perf_counter() - started, stage=stage)
+
+    @staticmethod
+    def _labels(labels):
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            snapshot = {name: {key: list(value) if isinstance(value, list) else value for key, value in values.items()}
+                        for name, values in self._values.items()}
+        for name, (kind, help_text, buckets) in self._metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(snapshot[name].items()):
+                if kind != "histogram":
+                    lines.append(f"{name}{self._labels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(key)} {value[-2]}")
+                lines.append(f"{name}_count{self._labels(key)} {value[-1]}")
+        for name, kind, help_text, fn in self._collectors:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in fn():
+                lines.append(f"{name}{self._labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("aar_stage_seconds", "histogram", "Time spent in each processing stage.")
+metrics.describe("aar_http_request_seconds", "histogram", "HTTP request latency by route and status.")
+metrics.describe("aar_chat_answers_total", "counter", "Chat messages by the stage that answered them.")
+metrics.describe("aar_rerank_queries_total", "counter", "Queries by whether their candidates were reranked or why not.")
+
+# Function to count a chat answer by the stage that produced it:
+# cache, direct, knowledge, keyword, fallback, empty or error
+def record_answer(stage, count=1):
+    metrics.inc("aar_chat_answers_total", count, stage=stage)
+
+# Sampling profiler for one thread: a background thread records the thread's
+# stack every interval. Stacks are kept in the folded format that flame graph
+# tools (flamegraph.pl, speedscope) read, one "a;b;c count" line per stack.
+class SamplingProfiler:
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+# Split text ids, sorted by token count, into buckets of similar length:
+# a bucket holds lengths within the same power of two, so nothing in it is
+# padded to more than twice its own length
+def length_buckets(order, lengths, max_bucket_size):
+    buckets = []
+    current = []
+    current_class = None
+    for i in order:
+        length_class = max(lengths[i] - 1, 1).bit_length()
+        if current and (length_class != current_class or len(current) == max_bucket_size):
+            buckets.append(current)
+            current = []
+        current.append(i)
+        current_class = length_class
+    if current:
+        buckets.append(current)
+    return buckets
+
+# Function to get BioBERT embeddings for a list of texts.
+# Texts are sorted by token count and run in length buckets of at most
+# max_batch_size texts (EMBED_MAX_BATCH by default), each padded only to its own
+# longest text.
+def embed_batch(texts, backend=None, max_length=DOCUMENT_MAX_TOKENS, max_batch_size=None):
+    load_model()
+    texts = list(texts)
+    backend = backend or embedding_backend
+    if not texts:
+        return np.empty((0, biobert_model.config.hidden_size), dtype=np.float32)
+    
+    # Tokenize without padding
+    started = time.perf_counter()
+    token_ids = tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+    lengths = [len(ids) for ids in token_ids]
+    order = sorted(range(len(texts)), key=lengths.__getitem__)
+    tokenize_seconds = time.perf_counter() - started
+    
+    embeddings = [None] * len(texts)
+    for bucket in length_buckets(order, lengths, max(max_batch_size or EMBED_MAX_BATCH, 1)):
+        started = time.perf_counter()
+        inputs = tokenizer.pad({"input_ids": [list(token_ids[i]) for i in bucket]}, return_tensors="pt")
+        if "token_type_ids" in tokenizer.model_input_names and "token_type_ids" not in inputs:
+            inputs["token_type_ids"] = torch.zeros_like(inputs["input_ids"])
+        tokenize_seconds += time.perf_counter() - started
+        
+        # Mean-pooled model output as a NumPy array
+        started = time.perf_counter()
+        bucket_embeddings = backend.embed(dict(inputs))
+        forward_seconds = time.perf_counter() - started
+        token_stats.record(sum(lengths[i] for i in bucket), inputs["input_ids"].numel(), forward_seconds)
+        metrics.observe("aar_stage_seconds", forward_seconds, stage="model_forward")
+        
+        for i, embedding in zip(bucket, bucket_embeddings):
+            embeddings[i] = embedding
     
-    return distance
+    metrics.observe("aar_stage_seconds", tokenize_seconds, stage="tokenize")
+    return np.stack(embeddings)
+
+# Function to embed chat queries, capped at QUERY_MAX_TOKENS
+def embed_queries(queries):
+    return embed_batch(queries, max_length=QUERY_MAX_TOKENS)
+
+embedding_batcher = EmbeddingBatcher(embed_queries, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS)
 
-# Function to get BioBERT embeddings
+# Function to run WARMUP_BATCHES batches of representative queries through the
+# serving backend, at one and at EMBED_MAX_BATCH queries and at short and long
+# lengths, so the first real queries don't pay for first-call allocations
+def warm_up_model():
+    started = time.perf_counter()
+    short_queries = list(medical_responses)
+    long_queries = list(expanded_knowledge)
+    for i in range(WARMUP_BATCHES):
+        queries = short_queries if i % 2 == 0 else long_queries
+        size = 1 if i % 3 == 0 else max(EMBED_MAX_BATCH, 1)
+        embed_queries([queries[(i * size + j) % len(queries)] for j in range(size)])
+    if reranker is not None:
+        # Also gives the reranker its first cost estimate
+        for i in range(WARMUP_BATCHES):
+            reranker.score([(short_queries[i % len(short_queries)], text) for text in long_queries[:RETRIEVAL_CANDIDATES]])
+    logger.info("Warmed up the %s embedding backend with %d batches in %.1fs",
+                embedding_backend.name, WARMUP_BATCHES, time.perf_counter() - started)
+
+# Function to load and warm up the model off the request path
+def load_model_in_background():
+    global model_error
+    try:
+        load_model()
+        load_reranker()
+        warm_up_model()
+        model_ready.set()
+    except Exception as e:
+        model_error = str(e)
+        logger.exception("BioBERT model loading failed: %s", e)
+
+# Start loading the model on a background thread, once per worker process
+def start_model_loading():
+    global model_loader
+    with model_loader_lock:
+        if model_loader is None and not model_ready.is_set():
+            model_loader = threading.Thread(target=load_model_in_background, name="model-loader", daemon=True)
+            model_loader.start()
+
+# Function to get the BioBERT embedding of a single text.
+# Goes through the batcher so concurrent requests share forward passes.
 def get_embedding(text):
-    # Tokenize the text
-    inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    
-    # Get model output
-    with torch.no_grad():
-        outputs = biobert_model(**inputs)
-    
-    # Mean pooling
-    token_embeddings = outputs.last_hidden_state
-    attention_mask = inputs['attention_mask']
-    input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
-    sum_embeddings = torch.sum(token_embeddings * input_mask_expanded, 1)
-    sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-    embedding = sum_embeddings / sum_mask
-    
-    # Convert to NumPy array
-    return embedding[0].cpu().numpy()
+    return embedding_batcher.submit(text).result()
 
-# Function to retrieve relevant knowledge
-def retrieve_knowledge(query, top_k=2):
-    # Get query embedding
-    query_embedding = get_embedding(query)
-    
-    # Calculate similarities with all knowledge chunks
-    similarities = []
-    for i, embedding in enumerate(knowledge_embeddings):
-        # Calculate cosine similarity
-        sim = np.dot(query_embedding, embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(embedding))
-        similarities.append((i, sim))
-    
-    # Sort by similarity (highest first)
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    
-    # Get top k similar chunks
-    top_chunks = []
-    for i, sim in similarities[:top_k]:
-        if sim > 0.5:  # Only include if similarity is above threshold
-            top_chunks.append((knowledge_texts[i], sim))
-    
-    return top_chunks
+response_cache = QueryCache(
+    "response", CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_DB_PATH,
+    encode=lambda value: value.encode("utf-8"),
+    decode=lambda value: bytes(value).decode("utf-8"),
+)
+embedding_cache = QueryCache(
+    "embedding", CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, CACHE_DB_PATH,
+    encode=lambda value: np.asarray(value, dtype=np.float32).tobytes(),
+    decode=lambda value: np.frombuffer(value, dtype=np.float32),
+)
+
+# Existing counters exposed on /metrics, read when it is scraped
+metrics.register_collector(
+    "aar_cache_lookups_total", "counter", "Query cache lookups by cache and result.",
+    lambda: [
+        ({"cache": cache.namespace, "result": result}, getattr(cache, attribute))
+        for cache in (response_cache, embedding_cache)
+        for result, attribute in (("hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))
+    ],
+)
+metrics.register_collector(
+    "aar_cache_entries", "gauge", "Entries in the in-process query cache.",
+    lambda: [({"cache": cache.namespace}, len(cache._entries)) for cache in (response_cache, embedding_cache)],
+)
+metrics.register_collector(
+    "aar_embedding_queue_depth", "gauge", "Queries waiting for the embedding batcher.",
+    lambda: [({}, embedding_batcher.stats()["queue_depth"])],
+)
+metrics.register_collector(
+    "aar_model_tokens_total", "counter", "Tokens run through the model, real and including padding.",
+    lambda: [({"kind": "real"}, token_stats.tokens), ({"kind": "padded"}, token_stats.padded_tokens)],
+)
+metrics.register_collector(
+    "aar_model_ready", "gauge", "1 once the model is loaded and warmed up.",
+    lambda: [({}, int(model_ready.is_set()))],
+)
+metrics.register_collector(
+    "aar_process_memory_bytes", "gauge", "Memory of this worker process.",
+    lambda: [({"kind": kind}, int(value * 1024 * 1024)) for kind, value in process_memory_mb().items()],
+)
+
+# Function to get the embedding of a user query, cached on the normalized text.
+def get_query_embedding(query):
+    embedding = embedding_cache.get(query, EMBEDDING_CACHE_VERSION)
+    if embedding is None:
+        embedding = np.asarray(get_embedding(query), dtype=np.float32)
+        embedding.setflags(write=False)
+        embedding_cache.set(query, EMBEDDING_CACHE_VERSION, embedding)
+    return embedding
+
+# Function to retrieve the answer candidates for a query: the closest
+# knowledge chunks and keywords, best first, from one search
+def retrieve_candidates(query, top_k=RETRIEVAL_CANDIDATES, state=None):
+    state = state or app_state
+    query_embedding = get_query_embedding(query)
+    with metrics.timer("candidate_search"):
+        return state.candidate_index.search_batch(query_embedding, top_k)[0]
 
 # Function to format retrieved knowledge into a response
 def format_response(query, knowledge_chunks):
@@ -398,53 +2480,223 @@ def format_response(query, knowledge_chunks):
     
     return response
 
-# Function to get response from the chatbot
-def get_chatbot_response(query):
+# Cosine similarity a knowledge chunk or keyword needs to be used as the answer
+# when it was not reranked
+ANSWER_MIN_SIMILARITY = 0.6
+
+# Canned chatbot replies
+EMPTY_MESSAGE_RESPONSE = "Please enter a question."
+ERROR_RESPONSE = "Sorry, I encountered an error processing your request. Please try again."
+WARMING_UP_RESPONSE = "I'm still getting ready and can only answer simple questions right now. Please try again in a moment. You can already use the clinic finder to locate your nearest AAR clinic."
+FALLBACK_RESPONSE = "I understand you're asking about a medical condition. While I can provide information on many health topics, I don't have specific details about this condition. I recommend visiting an AAR clinic for personalized medical advice. Would you like me to help you find the nearest AAR clinic?"
+
+# Function to get response from the chatbot, answering repeated questions from the cache.
+# The answering functions below take the app state the request started with, so
+# a reload in the middle of a request can't mix two states; it defaults to the current one.
+def get_chatbot_response(query, state=None):
+    state = state or app_state
     query = query.lower().strip()
     
-    # First, check for direct matches in predefined responses
-    for keyword, response in medical_responses.items():
-        if keyword in query:
-            print(f"Direct match found for keyword: {keyword}")
-            return response
-    
-    # If no direct match, try to retrieve relevant knowledge
-    print(f"No direct keyword match for: '{query}'. Using knowledge retrieval...")
-    knowledge_chunks = retrieve_knowledge(query)
-    
-    # If we found relevant knowledge, format it into a response
-    if knowledge_chunks and knowledge_chunks[0][1] > 0.6:  # Check if similarity is high enough
-        print(f"Found knowledge with similarity: {knowledge_chunks[0][1]:.4f}")
-        response = format_response(query, knowledge_chunks)
-        if response:
-            return response
-    
-    # As a fallback, use BioBERT for semantic similarity with keywords
-    print("Using keyword semantic matching as fallback...")
-    query_embedding = get_embedding(query)
-    similarities = []
-    
-    for keyword, response in medical_responses.items():
-        keyword_embedding = get_embedding(keyword)
-        similarity = np.dot(query_embedding, keyword_embedding) / (np.linalg.norm(query_embedding) * np.linalg.norm(keyword_embedding))
-        similarities.append((keyword, similarity))
-    
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    
-    # Print top 3 matches for debugging
-    print("Top 3 semantic matches:")
-    for keyword, score in similarities[:3]:
-        print(f"  {keyword}: {score:.4f}")
+    response = response_cache.get(query, state.cache_version)
+    if response is None:
+        response = generate_chatbot_response(query, state)
+        response_cache.set(query, state.cache_version, response)
+    else:
+        record_answer("cache")
+    return response
+
+# Function to answer a query without running the model: a cached response or
+# a direct keyword match. Returns None when the query needs inference.
+def get_fast_response(query, state=None):
+    state = state or app_state
+    query = query.lower().strip()
     
-    best_match_keyword, highest_similarity = similarities[0]
+    response = response_cache.get(query, state.cache_version)
+    if response is None:
+        response = get_direct_match_response(query, state)
+        if response is not None:
+            response_cache.set(query, state.cache_version, response)
+    else:
+        record_answer("cache")
+    return response
+
+# Function to look up a predefined response by keyword, None if no keyword matches
+def get_direct_match_response(query, state=None):
+    keyword = (state or app_state).keyword_matcher.best_match(query)
+    if keyword is None:
+        return None
+    logger.debug("Direct match found for keyword: %s", keyword)
+    record_answer("direct")
+    return medical_responses[keyword]
+
+# Function to work out the chatbot response for a normalized query
+def generate_chatbot_response(query, state=None):
+    state = state or app_state
+    # First, check for direct matches in predefined responses
+    response = get_direct_match_response(query, state)
+    if response is not None:
+        return response
+    
+    # If no direct match, answer from the closest knowledge chunk or keyword
+    logger.debug("No direct keyword match for: '%s'. Using retrieval...", query)
+    query_embedding = get_query_embedding(query)
+    response, stage = answer_from_embeddings([query], query_embedding.reshape(1, -1), state)[0]
+    record_answer(stage)
+    return response
+
+# Function to answer normalized queries from their embeddings in two stages:
+# one candidate search over knowledge chunks and keywords together, then the
+# candidates of as many queries as the latency budget allows are reranked in
+# one batch. Returns an (answer, stage) pair per query.
+def answer_from_embeddings(queries, query_embeddings, state=None):
+    with metrics.timer("candidate_search"):
+        candidate_lists = (state or app_state).candidate_index.search_batch(query_embeddings, RETRIEVAL_CANDIDATES)
+    rerank_scores = rerank_candidates(queries, candidate_lists)
+    
+    answers = []
+    for query, candidates, scores in zip(queries, candidate_lists, rerank_scores):
+        if scores is not None:
+            best = int(np.argmax(scores))
+            accepted = scores[best] > RERANK_MIN_SCORE
+        else:
+            best = 0
+            accepted = bool(candidates) and candidates[0].score > ANSWER_MIN_SIMILARITY
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Candidates for '%s': %s", query, ", ".join(
+                f"{candidate.kind}:{candidate.text[:30]!r} {candidate.score:.4f}" + (f"/{scores[i]:.4f}" if scores is not None else "")
+                for i, candidate in enumerate(candidates)))
+        
+        if not accepted:
+            answers.append((FALLBACK_RESPONSE, "fallback"))
+        elif candidates[best].kind == "knowledge":
+            answers.append((format_response(query, [(candidates[best].text, candidates[best].score)]), "knowledge"))
+        else:
+            answers.append((medical_responses[candidates[best].text], "keyword"))
+    return answers
+
+# Function to rerank candidate lists with the cross-encoder in one batch.
+# Returns an array of scores per query, or None for queries answered from the
+# first stage: no reranker, over the latency budget, or all rerank slots busy.
+def rerank_candidates(queries, candidate_lists):
+    skipped = [None] * len(queries)
+    if reranker is None:
+        return skipped
+    wanted = [i for i, candidates in enumerate(candidate_lists) if len(candidates) > 1]
+    if not wanted:
+        return skipped
+    
+    # Whole queries only, in order, as many as the budget fits
+    pairs_per_query = max(len(candidate_lists[i]) for i in wanted)
+    fit = reranker.pairs_within(RERANK_BUDGET_MS / 1000.0, pairs_per_query * len(wanted)) // pairs_per_query
+    if fit < len(wanted):
+        metrics.inc("aar_rerank_queries_total", len(wanted) - fit, result="over_budget")
+    if not fit:
+        return skipped
+    if not reranker.slots.acquire(blocking=False):
+        metrics.inc("aar_rerank_queries_total", fit, result="busy")
+        return skipped
     
-    # If similarity is high enough, use that response
-    if highest_similarity > 0.6:
-        print(f"Using response for '{best_match_keyword}' with similarity {highest_similarity:.4f}")
-        return medical_responses[best_match_keyword]
+    try:
+        reranked = wanted[:fit]
+        pairs = [(queries[i], candidate.passage) for i in reranked for candidate in candidate_lists[i]]
+        with metrics.timer("rerank"):
+            scores = reranker.score(pairs)
+    finally:
+        reranker.slots.release()
+    metrics.inc("aar_rerank_queries_total", len(reranked), result="reranked")
+    
+    results = list(skipped)
+    start = 0
+    for i in reranked:
+        results[i] = scores[start:start + len(candidate_lists[i])]
+        start += len(candidate_lists[i])
+    return results
+
+# Function to answer many messages at once, yielding responses in input order.
+# Works through the messages in chunks of BATCH_CHUNK_SIZE: direct keyword and
+# cache hits are answered first, the rest of the chunk is embedded in one
+# batched pass and answered by answer_from_embeddings together.
+def get_chatbot_responses(messages):
+    chunk = []
+    for message in messages:
+        chunk.append(message)
+        if len(chunk) == BATCH_CHUNK_SIZE:
+            yield from answer_message_chunk(chunk)
+            chunk = []
+    if chunk:
+        yield from answer_message_chunk(chunk)
+
+# Function to answer one chunk of get_chatbot_responses, same stages as get_chatbot_response
+def answer_message_chunk(messages):
+    state = app_state
+    responses = [None] * len(messages)
+    pending = {}  # normalized query -> positions still needing the model
+    
+    for position, message in enumerate(messages):
+        query = message.lower().strip() if isinstance(message, str) else ""
+        if not query:
+            responses[position] = EMPTY_MESSAGE_RESPONSE
+            record_answer("empty")
+            continue
+        response = get_fast_response(query, state)
+        if response is not None:
+            responses[position] = response
+        else:
+            pending.setdefault(query, []).append(position)
+    
+    # Until the model is ready, only the fast answers above are available
+    if pending and not model_ready.is_set():
+        for query, positions in pending.items():
+            record_answer("warming_up", len(positions))
+            for position in positions:
+                responses[position] = WARMING_UP_RESPONSE
+        pending = {}
+    
+    if pending:
+        queries = list(pending)
+        cached = [embedding_cache.get(query, EMBEDDING_CACHE_VERSION) for query in queries]
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        if missing:
+            new_embeddings = embed_queries([queries[i] for i in missing])
+            for i, embedding in zip(missing, new_embeddings):
+                cached[i] = embedding
+                embedding_cache.set(queries[i], EMBEDDING_CACHE_VERSION, embedding)
+        query_embeddings = np.stack(cached)
+        
+        for query, (answer, stage) in zip(queries, answer_from_embeddings(queries, query_embeddings, state)):
+            response_cache.set(query, state.cache_version, answer)
+            record_answer(stage, len(pending[query]))
+            for position in pending[query]:
+                responses[position] = answer
     
-    # Last resort fallback
-    return "I understand you're asking about a medical condition. While I can provide information on many health topics, I don't have specific details about this condition. I recommend visiting an AAR clinic for personalized medical advice. Would you like me to help you find the nearest AAR clinic?"
+    return responses
+
+# Function to find the clinics closest to a /find-clinics request body.
+# Returns (payload, HTTP status).
+def find_nearby_clinics(data):
+    # Validate user location from request
+    user_location = data.get("location", {})
+    user_lat = user_location.get("lat")
+    user_lng = user_location.get("lng")
+    
+    if not isinstance(user_lat, (int, float)) or not isinstance(user_lng, (int, float)):
+        return {"error": "Invalid location data. Latitude and longitude must be numbers."}, 400
+    
+    # Optional number of clinics to return and search radius in km
+    k = data.get("k", 3)
+    max_km = data.get("max_km")
+    if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= MAX_CLINICS_PER_QUERY:
+        return {"error": f"k must be an integer between 1 and {MAX_CLINICS_PER_QUERY}."}, 400
+    if max_km is not None and (isinstance(max_km, bool) or not isinstance(max_km, (int, float)) or max_km <= 0):
+        return {"error": "max_km must be a positive number."}, 400
+    
+    # Closest clinics from the in-memory spatial index
+    with metrics.timer("clinic_nearest"):
+        closest = app_state.clinic_index.nearest(user_lat, user_lng, k, max_km)
+    closest_clinics = [dict(clinic.to_dict(), distance=distance) for clinic, distance in closest]
+    
+    return {"clinics": closest_clinics}, 200
 
 @app.route("/")
 def home():
@@ -459,56 +2711,360 @@ def chat_api():
     try:
         user_input = request.json.get("message", "").strip()
         if not user_input:
-            return jsonify({"response": "Please enter a question."})
+            record_answer("empty")
+            return jsonify({"response": EMPTY_MESSAGE_RESPONSE})
         
-        # Get response from the chatbot
-        response = get_chatbot_response(user_input)
+        # Get response from the chatbot; while the model warms up only
+        # cached answers and direct keyword matches are available
+        state = app_state
+        if model_ready.is_set():
+            response = get_chatbot_response(user_input, state)
+        else:
+            response = get_fast_response(user_input, state)
+            if response is None:
+                record_answer("warming_up")
+                response = WARMING_UP_RESPONSE
         
         return jsonify({"response": response})
     
     except Exception as e:
-        print(f"Error in chat_api: {e}")
-        return jsonify({"response": "Sorry, I encountered an error processing your request. Please try again."})
+        logger.exception("Error in chat_api: %s", e)
+        record_answer("error")
+        return jsonify({"response": ERROR_RESPONSE})
+
+INVALID_BATCH_MESSAGE = "Each message must be a string or an object with a string \"message\" field."
+
+# Function to pull the message text out of one /chat/batch item, None if it is malformed
+def batch_message_text(record):
+    if isinstance(record, dict):
+        record = record.get("message")
+    return record if isinstance(record, str) else None
+
+# Messages of a /chat/batch request as (message, error) pairs: a JSON list of
+# messages, or an NDJSON body with one message string or {"message": ...} object
+# per line, which is read line by line
+def iter_batch_messages(messages=None):
+    if messages is not None:
+        for record in messages:
+            message = batch_message_text(record)
+            yield message, None if message is not None else INVALID_BATCH_MESSAGE
+        return
+    for line in request.stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            message = batch_message_text(json.loads(line))
+        except ValueError:
+            message = None
+        yield message, None if message is not None else INVALID_BATCH_MESSAGE
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch_api():
+    messages = None
+    if request.mimetype != "application/x-ndjson":
+        data = request.get_json(silent=True)
+        messages = data.get("messages") if isinstance(data, dict) else None
+        if not isinstance(messages, list):
+            return jsonify({"error": "Send a JSON body {\"messages\": [...]} or an NDJSON body."}), 400
+    
+    # Each response is streamed back as its own NDJSON line as soon as its chunk
+    # is done. Malformed messages get an error line and are skipped by the model.
+    def generate():
+        errors = {}
+        
+        def valid_messages():
+            for index, (message, error) in enumerate(iter_batch_messages(messages)):
+                if error is None:
+                    yield message
+                else:
+                    errors[index] = error
+        
+        index = 0
+        try:
+            for response in get_chatbot_responses(valid_messages()):
+                while index in errors:
+                    yield json.dumps({"index": index, "error": errors.pop(index)}) + "\n"
+                    index += 1
+                yield json.dumps({"index": index, "response": response}) + "\n"
+                index += 1
+            for index in sorted(errors):
+                yield json.dumps({"index": index, "error": errors[index]}) + "\n"
+        except Exception as e:
+            logger.exception("Error in chat_batch_api: %s", e)
+            yield json.dumps({"index": index, "error": ERROR_RESPONSE}) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.route("/find-clinics", methods=["POST"])
 def find_clinics():
     try:
-        # Validate user location from request
-        user_location = request.json.get("location", {})
-        user_lat = user_location.get("lat")
-        user_lng = user_location.get("lng")
-        
-        if not isinstance(user_lat, (int, float)) or not isinstance(user_lng, (int, float)):
-            return jsonify({"error": "Invalid location data. Latitude and longitude must be numbers."}), 400
-        
-        # Get clinics from database
-        all_clinics = get_all_clinics()
-        
-        # Calculate distance to each clinic
-        clinics_with_distance = []
-        for clinic in all_clinics:
-            distance = calculate_distance(user_lat, user_lng, clinic["lat"], clinic["lng"])
-            clinic_copy = clinic.copy()
-            clinic_copy["distance"] = distance
-            clinics_with_distance.append(clinic_copy)
-        
-        # Sort clinics by distance
-        clinics_with_distance.sort(key=lambda x: x["distance"])
-        
-        # Return the 3 closest clinics
-        closest_clinics = clinics_with_distance[:3]
-        
-        return jsonify({"clinics": closest_clinics})
+        payload, status = find_nearby_clinics(request.json)
+        return jsonify(payload), status
     
     except Exception as e:
-        print(f"Error finding clinics: {e}")
+        logger.exception("Error finding clinics: %s", e)
         return jsonify({"error": "An error occurred while finding clinics."}), 500
 
-# Initialize before the first request
+# Liveness: the process is serving. Fails only if the model could not be
+# loaded, since the worker then never becomes ready and should be restarted.
+@app.route("/healthz")
+def healthz():
+    if model_error is not None:
+        return jsonify({"status": "failed", "error": model_error}), 503
+    return jsonify({"status": "ok"})
+
+# Readiness: the model is loaded and warmed up, so /chat gives full answers
+@app.route("/readyz")
+def readyz():
+    if model_ready.is_set() and app_state is not None:
+        return jsonify({"status": "ready"})
+    return jsonify({"status": "failed" if model_error is not None else "loading"}), 503
+
+@app.route("/stats")
+def stats():
+    return jsonify({
+        "pid": os.getpid(),
+        "memory_mb": process_memory_mb(),
+        "model": {"ready": model_ready.is_set(), "error": model_error},
+        "knowledge": {
+            "generation": app_state.knowledge_generation,
+            "segments": len(app_state.knowledge_parts) - 1,
+            "chunks": knowledge_chunk_count(app_state),
+        } if app_state is not None else None,
+        "embedding_batcher": embedding_batcher.stats(),
+        "tokens": token_stats.stats(),
+        "response_cache": response_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+    })
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Whether the request carries the admin token; False when none is configured
+def has_admin_token():
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+# Reloads this worker now; the other workers follow within KNOWLEDGE_REFRESH_SECONDS
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    # Disabled unless an admin token is configured
+    if not has_admin_token():
+        return jsonify({"error": "Not authorized."}), 403
+    try:
+        state = request_reload()
+        return jsonify({
+            "status": "reloaded",
+            "generation": state.reload_generation,
+            "knowledge_chunks": knowledge_chunk_count(state),
+            "keywords": len(state.keyword_index_keywords),
+            "clinics": len(state.clinic_index),
+        })
+    except Exception as e:
+        logger.exception("Error reloading app state: %s", e)
+        return jsonify({"error": "Reload failed, previous state is still active."}), 500
+
+@app.cli.command("build-index")
+@click.option("--source", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="JSONL file of knowledge texts. Defaults to the built-in knowledge base.")
+@click.option("--batch-size", type=click.IntRange(min=1), default=32, show_default=True,
+              help="Number of texts embedded per forward pass.")
+@click.option("--restart", is_flag=True, help="Ignore any checkpoint and embed everything again.")
+@click.option("--dtype", type=click.Choice(["float32", "float16"]), default="float32", show_default=True,
+              help="Storage type of the embeddings; float16 halves the index size.")
+def build_index_command(source, batch_size, restart, dtype):
+    """Embed the knowledge base and keyword index offline."""
+    count = build_knowledge_index(source=source, batch_size=batch_size, restart=restart, dtype=dtype)
+    if count >= ANN_MIN_CHUNKS:
+        build_ann_index()
+    setup_keyword_index()
+
+@app.cli.command("build-ann-index")
+@click.option("--nlist", type=click.IntRange(min=1), default=None,
+              help="Number of inverted lists. Defaults to 4 * sqrt(chunks).")
+@click.option("--iterations", type=click.IntRange(min=1), default=10, show_default=True,
+              help="k-means iterations.")
+@click.option("--sample-size", type=click.IntRange(min=1), default=None,
+              help="Rows the centroids are trained on. Defaults to 64 per list.")
+def build_ann_index_command(nlist, iterations, sample_size):
+    """Build the IVF index used for knowledge bases of ANN_MIN_CHUNKS or more."""
+    build_ann_index(nlist=nlist, iterations=iterations, sample_size=sample_size)
+
+@app.cli.command("knowledge-sync")
+@click.option("--source", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="JSONL file of knowledge texts. Defaults to the built-in knowledge base.")
+def knowledge_sync_command(source):
+    """Add new chunks from a source and delete chunks no longer in it."""
+    sync_knowledge(source)
+
+@app.cli.command("knowledge-add")
+@click.option("--source", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="JSONL file of knowledge texts to add.")
+@click.option("--text", "texts", multiple=True, help="Knowledge text to add; can be repeated.")
+def knowledge_add_command(source, texts):
+    """Add knowledge chunks, embedding only the new ones."""
+    update_knowledge(list(texts) + (list(iter_knowledge_source(source)) if source else []))
+
+@app.cli.command("knowledge-delete")
+@click.argument("content_hashes", nargs=-1, required=True)
+def knowledge_delete_command(content_hashes):
+    """Delete knowledge chunks by content hash (or a unique prefix of one)."""
+    update_knowledge(delete_hashes=resolve_content_hashes(content_hashes))
+
+@app.cli.command("knowledge-update")
+@click.argument("content_hash")
+@click.argument("text")
+def knowledge_update_command(content_hash, text):
+    """Replace the knowledge chunk with a content hash by a new text."""
+    replace_knowledge_chunk(resolve_content_hashes([content_hash])[0], text)
+
+@app.cli.command("knowledge-compact")
+def knowledge_compact_command():
+    """Merge the knowledge segments into the base index."""
+    compact_knowledge_index()
+
+# Expand content hash prefixes to the full hashes of live chunks
+def resolve_content_hashes(prefixes):
+    manifest, segments = open_knowledge_for_update()
+    live = knowledge_live_rows(manifest, segments)
+    content_hashes = []
+    for prefix in prefixes:
+        matches = [content_hash for content_hash in live if content_hash.startswith(prefix)]
+        if len(matches) != 1:
+            raise click.ClickException(f"{prefix} matches {len(matches)} knowledge chunks, expected one.")
+        content_hashes.append(matches[0])
+    return content_hashes
+
+@app.cli.command("ann-recall")
+@click.option("--k", "top_k", type=click.IntRange(min=1), default=10, show_default=True)
+@click.option("--nprobe", "nprobes", default="1,4,16,32,64", show_default=True,
+              help="Comma-separated nprobe values to try.")
+@click.option("--queries", "num_queries", type=click.IntRange(min=1), default=500, show_default=True,
+              help="Number of queries sampled when no query file is given.")
+@click.option("--query-file", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Text file with one query per line, embedded with EMBEDDING_BACKEND.")
+@click.option("--noise", type=float, default=0.5, show_default=True,
+              help="Noise added to sampled chunk embeddings so they are not exact matches.")
+def ann_recall_command(top_k, nprobes, num_queries, query_file, noise):
+    """Measure recall@k and latency of the IVF index against exact search."""
+    knowledge_texts, knowledge_embeddings, manifest = setup_knowledge_base()
+    ann_index = load_ann_index(knowledge_embeddings, manifest)
+    if ann_index is None:
+        raise click.ClickException("No IVF index for the current knowledge index, run `flask build-ann-index`.")
+    exact_index = RetrievalEngine(knowledge_embeddings, normalized=True)
+    
+    if query_file:
+        with open(query_file, 'r', encoding='utf-8') as f:
+            queries = embed_queries([line.strip() for line in f if line.strip()])
+    else:
+        # Chunk embeddings pushed off in a random direction stand in for real queries
+        rng = np.random.default_rng(0)
+        rows = np.sort(rng.choice(len(exact_index), min(num_queries, len(exact_index)), replace=False))
+        queries = np.asarray(knowledge_embeddings[rows], dtype=np.float32)
+        queries = queries + noise * RetrievalEngine.normalize(rng.standard_normal(queries.shape, dtype=np.float32))
+    queries = RetrievalEngine.normalize(queries)
+    
+    started = time.perf_counter()
+    exact_ids, _ = exact_index.search_batch(queries, top_k)
+    exact_ms = 1000.0 * (time.perf_counter() - started) / len(queries)
+    print(f"{len(queries)} queries, {len(exact_index)} chunks, {len(ann_index.centroids)} lists, exact search {exact_ms:.2f} ms per query")
+    
+    for nprobe in (int(value) for value in nprobes.split(",")):
+        started = time.perf_counter()
+        ann_ids, _ = ann_index.search_batch(queries, top_k, nprobe)
+        ann_ms = 1000.0 * (time.perf_counter() - started) / len(queries)
+        recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(ann_ids, exact_ids)])
+        print(f"  nprobe={nprobe:<4d} recall@{top_k} {recall:.4f}  {ann_ms:.2f} ms per query")
+
+@app.cli.command("export-onnx")
+def export_onnx_command():
+    """Export BioBERT with mean pooling to ONNX_MODEL_PATH."""
+    export_onnx_model(ONNX_MODEL_PATH)
+
+@app.cli.command("embedding-parity")
+@click.option("--backend", "backend_name", type=click.Choice(["torch-int8", "onnx"]), default=None,
+              help="Backend to compare against fp32. Defaults to EMBEDDING_BACKEND.")
+@click.option("--batch-size", type=click.IntRange(min=1), default=16, show_default=True)
+def embedding_parity_command(backend_name, batch_size):
+    """Compare a backend's embeddings with fp32 PyTorch on the knowledge texts."""
+    load_model()
+    backend = create_embedding_backend(backend_name) if backend_name else embedding_backend
+    knowledge_texts = setup_knowledge_base()[0]
+    texts = list(knowledge_texts) if len(knowledge_texts) else list(expanded_knowledge)
+
+    similarities = []
+    timings = {reference_backend.name: 0.0, backend.name: 0.0}
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        results = []
+        for candidate in (reference_backend, backend):
+            started = time.perf_counter()
+            results.append(RetrievalEngine.normalize(embed_batch(batch, candidate, max_batch_size=batch_size)))
+            timings[candidate.name] += time.perf_counter() - started
+        similarities.append(np.sum(results[0] * results[1], axis=1))
+    similarities = np.concatenate(similarities)
+
+    print(f"Cosine agreement of {backend.name} with fp32 over {len(texts)} knowledge texts:")
+    print(f"  mean {similarities.mean():.5f}  min {similarities.min():.5f}  p5 {np.percentile(similarities, 5):.5f}")
+    for name, seconds in timings.items():
+        print(f"  {name}: {1000.0 * seconds / len(texts):.2f} ms per text")
+
+# Time every request, and start the sampling profiler when the request asks for it
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+    if PROFILE_DIR and request.headers.get("X-Profile") == "1" and has_admin_token():
+        g.profiler = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0).start()
+
+@app.after_request
+def finish_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    started = g.request_started
+    labels = {"route": route, "method": request.method, "status": str(response.status_code)}
+    # A streamed body (/chat/batch) is generated after this hook returns, so its
+    # latency is recorded when the server closes the response after the last chunk
+    if response.is_streamed:
+        response.call_on_close(lambda: metrics.observe("aar_http_request_seconds", time.perf_counter() - started, **labels))
+    else:
+        metrics.observe("aar_http_request_seconds", time.perf_counter() - started, **labels)
+    
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_file = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-{os.getpid()}-{route.strip('/').replace('/', '_') or 'root'}.folded")
+        profiler.write_folded(profile_file)
+        response.headers["X-Profile-File"] = profile_file
+        logger.info("Wrote profile of %s %s (%d samples) to %s", request.method, request.path, sum(profiler.samples.values()), profile_file)
+    return response
+
+# Initialize once per worker; after the first request this is a single global check
 @app.before_request
 def initialize():
-    setup_database()
-    setup_knowledge_base()
+    if app_state is None:
+        init_app_state()
+
+# SIGHUP to a worker triggers a hot reload of every worker, like /admin/reload.
+# The reload runs on its own thread so the signal handler returns immediately.
+def handle_reload_signal(signum, frame):
+    threading.Thread(target=request_reload, daemon=True).start()
+
+if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, handle_reload_signal)
+
+# With PRELOAD_MODEL the model is loaded and warmed up at import, e.g. once in
+# the gunicorn master so forked workers share its weights
+if PRELOAD_MODEL:
+    try:
+        load_model()
+        load_reranker()
+        warm_up_model()
+        model_ready.set()
+    except Exception as e:
+        logger.error("BioBERT model loading failed: %s", e)
+        exit(1)
 
 if __name__ == "__main__":
     # Use environment variables for configuration in production
@@ -516,8 +3072,7 @@ if __name__ == "__main__":
     host = os.getenv('HOST', '0.0.0.0')
     
     # Setup the database and knowledge base
-    setup_database()
-    setup_knowledge_base()
+    init_app_state()
     
     # Run the app
     app.run(host=host, port=port, debug=DEBUG_MODE)
\ No newline at end of file
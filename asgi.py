@@ -0,0 +1,171 @@
+# ASGI serving mode for the AAR chatbot: `uvicorn asgi:application`
+#
+# /chat and /find-clinics keep the same request and response contracts as the
+# Flask routes in app.py. Clinic lookups, in-memory cache hits and direct
+# keyword matches are answered on the event loop; the response cache's SQLite
+# tier is read on the default executor, and BioBERT inference runs on a bounded
+# thread pool, so a slow query never blocks other requests. Every other route,
+# including /healthz and /readyz, is served by the Flask app through asgiref.
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as chatbot
+
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '4'))
+# Inference requests allowed to wait for a free worker before /chat answers 429
+INFERENCE_QUEUE_SIZE = int(os.getenv('INFERENCE_QUEUE_SIZE', '32'))
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv('INFERENCE_TIMEOUT_SECONDS', '10'))
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+# One slot per running or queued inference request
+inference_slots = threading.BoundedSemaphore(INFERENCE_WORKERS + INFERENCE_QUEUE_SIZE)
+
+chatbot.metrics.describe("aar_inference_rejected_total", "counter", "Chat requests answered 429 because the inference queue was full.")
+chatbot.metrics.describe("aar_inference_timeouts_total", "counter", "Chat requests that got the fallback answer after INFERENCE_TIMEOUT_SECONDS.")
+
+flask_application = WsgiToAsgi(chatbot.app)
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def read_json(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return json.loads(body or b"{}")
+
+# Load the app state on a worker thread the first time, so the event loop stays
+# responsive. Reloads and new knowledge generations are picked up by the app's
+# own refresh thread, so after that this is a single global check.
+async def ensure_app_state():
+    if chatbot.app_state is None:
+        await asyncio.get_running_loop().run_in_executor(None, chatbot.init_app_state)
+    return chatbot.app_state
+
+# Answer without the model if possible: in-memory cache hits and direct keyword
+# matches inline, then the response cache's SQLite tier on the default executor
+async def get_fast_response(query, state):
+    response = chatbot.response_cache.get(query, state.cache_version, local_only=True)
+    if response is not None:
+        chatbot.record_answer("cache")
+        return response
+    response = chatbot.get_direct_match_response(query, state)
+    if response is None and chatbot.response_cache.db_path:
+        response = await asyncio.get_running_loop().run_in_executor(None, chatbot.response_cache.get, query, state.cache_version)
+        if response is not None:
+            chatbot.record_answer("cache")
+    return response
+
+# Run the full chatbot pipeline on the inference pool; the slot is given back
+# when the work finishes, even if the request already timed out
+def run_inference(query, state):
+    try:
+        return chatbot.get_chatbot_response(query, state)
+    finally:
+        inference_slots.release()
+
+async def chat(receive, send):
+    try:
+        user_input = (await read_json(receive)).get("message", "").strip()
+        if not user_input:
+            chatbot.record_answer("empty")
+            return await send_json(send, {"response": chatbot.EMPTY_MESSAGE_RESPONSE})
+
+        state = await ensure_app_state()
+        query = user_input.lower()
+        response = await get_fast_response(query, state)
+        if response is not None:
+            return await send_json(send, {"response": response})
+        if not chatbot.model_ready.is_set():
+            chatbot.record_answer("warming_up")
+            return await send_json(send, {"response": chatbot.WARMING_UP_RESPONSE})
+
+        if not inference_slots.acquire(blocking=False):
+            chatbot.metrics.inc("aar_inference_rejected_total")
+            return await send_json(send, {"error": "The server is busy, please try again shortly."}, 429)
+        try:
+            future = inference_executor.submit(run_inference, query, state)
+        except Exception:
+            inference_slots.release()
+            raise
+        try:
+            response = await asyncio.wait_for(asyncio.wrap_future(future), INFERENCE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            chatbot.logger.warning("Chat inference timed out after %ss", INFERENCE_TIMEOUT_SECONDS)
+            chatbot.metrics.inc("aar_inference_timeouts_total")
+            response = chatbot.FALLBACK_RESPONSE
+        return await send_json(send, {"response": response})
+
+    except Exception as e:
+        chatbot.logger.exception("Error in chat: %s", e)
+        chatbot.record_answer("error")
+        return await send_json(send, {"response": chatbot.ERROR_RESPONSE})
+
+async def find_clinics(receive, send):
+    try:
+        data = await read_json(receive)
+        await ensure_app_state()
+        payload, status = chatbot.find_nearby_clinics(data)
+        return await send_json(send, payload, status)
+    except Exception as e:
+        chatbot.logger.exception("Error finding clinics: %s", e)
+        return await send_json(send, {"error": "An error occurred while finding clinics."}, 500)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await ensure_app_state()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            inference_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+# Run a route handler, recording its latency and status like the Flask routes do
+async def timed(handler, scope, receive, send):
+    started = time.perf_counter()
+    status = 500
+
+    async def send_with_status(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    try:
+        return await handler(receive, send_with_status)
+    finally:
+        chatbot.metrics.observe("aar_http_request_seconds", time.perf_counter() - started,
+                                route=scope["path"], method=scope["method"], status=str(status))
+
+ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/find-clinics"): find_clinics,
+}
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["type"] == "http":
+        handler = ROUTES.get((scope["method"], scope["path"]))
+        if handler is not None:
+            return await timed(handler, scope, receive, send)
+
+    return await flask_application(scope, receive, send)
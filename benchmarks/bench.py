@@ -0,0 +1,371 @@
+# Benchmark harness for the chat and clinic-finder hot paths.
+#
+#   python benchmarks/bench.py --scales 1,10,100,1000 --output results.json
+#   python benchmarks/bench.py --compare results.json --output new.json
+#
+# Every scale runs in its own process against a synthetic knowledge base and
+# clinic table (the built-in ones copied `scale` times), so peak memory is
+# measured per scale. By default the app is loaded with a tiny randomly
+# initialized BERT written to the work directory, so the benchmark runs offline
+# and measures the code around the model rather than BioBERT itself; pass
+# --model to benchmark a real model. Its similarity scores are meaningless, so
+# the answers differ from BioBERT's but every stage still runs.
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Kenya, where the sample clinics are
+CLINIC_BBOX = (-4.7, 5.0, 33.9, 41.9)
+
+QUERY_TEMPLATES = [
+    "what is {}",
+    "I think I have {}",
+    "what are the symptoms of {}?",
+    "how do you treat {}",
+    "{}",
+]
+
+# Function to write a tiny BERT model and tokenizer that stands in for BioBERT
+def write_stand_in_model(model_dir, texts):
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    # Vocabulary of the words and characters in the built-in texts, so most
+    # tokens are real pieces rather than [UNK]
+    words = sorted({word for text in texts for word in re.findall(r"\w+|[^\w\s]", text)})
+    characters = sorted({character for word in words for character in word})
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + characters + ["##" + c for c in characters] + words
+    vocab = list(dict.fromkeys(vocab))
+
+    os.makedirs(model_dir, exist_ok=True)
+    vocab_file = os.path.join(model_dir, "vocab.txt")
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(vocab) + "\n")
+    BertTokenizerFast(vocab_file=vocab_file, do_lower_case=False).save_pretrained(model_dir)
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=64, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=128, max_position_embeddings=512)
+    BertModel(config).save_pretrained(model_dir)
+
+# Function to read a query corpus: JSONL lines holding a string, or an object
+# with a "message", "query", "text" or "title" field (requests.jsonl style)
+def load_corpus(path):
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, dict):
+                record = next((record[key] for key in ("message", "query", "text", "title") if key in record), None)
+            if isinstance(record, str) and record.strip():
+                queries.append(record.strip())
+    return queries
+
+# Function to generate chat queries: direct keyword questions, fragments of
+# knowledge chunks, and shuffled word salad that usually ends in the fallback
+def synthetic_queries(count, keywords, knowledge_texts, rng):
+    words = [word for text in knowledge_texts for word in text.lower().split()]
+    queries = []
+    for i in range(count):
+        kind = i % 10
+        if kind < 3:
+            queries.append(rng.choice(QUERY_TEMPLATES).format(rng.choice(keywords)))
+        elif kind < 7:
+            text_words = rng.choice(knowledge_texts).split()
+            start = rng.randrange(max(1, len(text_words) - 10))
+            queries.append(" ".join(text_words[start:start + rng.randint(4, 10)]))
+        else:
+            queries.append(" ".join(rng.sample(words, rng.randint(3, 8))))
+    return queries
+
+# Function to generate /find-clinics payloads spread over the clinic area
+def synthetic_locations(count, rng):
+    min_lat, max_lat, min_lng, max_lng = CLINIC_BBOX
+    return [
+        {
+            "location": {"lat": rng.uniform(min_lat, max_lat), "lng": rng.uniform(min_lng, max_lng)},
+            "k": rng.choice([3, 5, 10]),
+            "max_km": rng.choice([None, 50, 200]),
+        }
+        for _ in range(count)
+    ]
+
+# Knowledge texts for a scale: the originals, then copies with their sentences
+# shuffled and some dropped so every chunk embeds differently
+def scaled_knowledge(knowledge_texts, scale, rng):
+    yield from knowledge_texts
+    for _ in range(scale - 1):
+        for text in knowledge_texts:
+            sentences = re.split(r"(?<=\.)\s+", text)
+            rng.shuffle(sentences)
+            keep = max(1, len(sentences) - rng.randint(0, 1))
+            yield " ".join(sentences[:keep])
+
+# Function to copy the clinic table and add scale - 1 jittered copies of every clinic
+def write_scaled_clinics(source_db, target_db, scale, rng):
+    with sqlite3.connect(source_db) as source:
+        clinics = source.execute("SELECT name, address, lat, lng, phone FROM clinics ORDER BY id").fetchall()
+    conn = sqlite3.connect(target_db)
+    conn.execute("""
+    CREATE TABLE clinics (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        address TEXT NOT NULL,
+        lat REAL NOT NULL,
+        lng REAL NOT NULL,
+        phone TEXT NOT NULL
+    )
+    """)
+    rows = list(clinics)
+    for copy in range(1, scale):
+        for name, address, lat, lng, phone in clinics:
+            rows.append((f"{name} #{copy}", address, lat + rng.gauss(0, 0.3), lng + rng.gauss(0, 0.3), phone))
+    conn.executemany("INSERT INTO clinics (name, address, lat, lng, phone) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return len(rows)
+
+def summarize(latencies, total_seconds, items_per_op=1):
+    latencies_ms = 1000.0 * np.asarray(latencies)
+    return {
+        "ops": len(latencies),
+        "items_per_op": items_per_op,
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "throughput_per_s": len(latencies) * items_per_op / total_seconds if total_seconds else 0.0,
+    }
+
+# Time fn on every input after a few untimed warm-up calls; reset runs
+# between the warm-up and the timed pass
+def measure(fn, inputs, warmup=5, items_per_op=1, reset=None):
+    for item in inputs[:warmup]:
+        fn(item)
+    if reset is not None:
+        reset()
+    latencies = []
+    started = time.perf_counter()
+    for item in inputs:
+        call_started = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, time.perf_counter() - started, items_per_op)
+
+# Run every stage at one scale inside this process; the environment points
+# app.py at the scale's knowledge base, clinic table and model
+def run_scale(scale, queries, locations):
+    sys.path.insert(0, REPO_ROOT)
+    import app as chatbot
+
+    results = {"scale": scale}
+    started = time.perf_counter()
+    results["knowledge_chunks"] = chatbot.build_knowledge_index(source=os.environ["BENCH_KNOWLEDGE_SOURCE"], batch_size=64)
+    chatbot.setup_keyword_index()
+    results["build_index_seconds"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chatbot.init_app_state()
+    while not chatbot.model_ready.wait(0.1):
+        if chatbot.model_error is not None:
+            raise RuntimeError(f"Model failed to load: {chatbot.model_error}")
+    state = chatbot.app_state
+    results["load_seconds"] = time.perf_counter() - started
+    results["clinics"] = len(state.clinic_index.clinics)
+    results["knowledge_index"] = type(state.knowledge_index).__name__
+    results["memory_after_load_mb"] = chatbot.process_memory_mb()
+
+    # Timed passes start with empty caches so they measure the uncached path;
+    # repeated queries within a pass still hit the cache, as they would live
+    def clear_caches():
+        chatbot.response_cache.invalidate(state.cache_version)
+        chatbot.embedding_cache.invalidate(chatbot.EMBEDDING_CACHE_VERSION)
+
+    query_embeddings = chatbot.RetrievalEngine.normalize(chatbot.embed_queries(queries))
+    embedding_inputs = list(query_embeddings)
+    client = chatbot.app.test_client()
+    batch_size = chatbot.BATCH_CHUNK_SIZE
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
+
+    chat = lambda query: client.post("/chat", json={"message": query})
+    messages_per_batch = len(queries) / len(batches)
+
+    # (name, function, inputs, items per call, start from empty caches)
+    stages = [
+        ("direct_match", chatbot.get_direct_match_response, queries, 1, True),
+        ("embed_query", lambda query: chatbot.embed_queries([query]), queries, 1, True),
+        ("knowledge_search", lambda embedding: state.knowledge_index.search(embedding, 2), embedding_inputs, 1, True),
+        ("keyword_search", lambda embedding: state.keyword_index.search(embedding, 1), embedding_inputs, 1, True),
+        ("retrieve_candidates", chatbot.retrieve_candidates, queries, 1, True),
+        ("generate_chatbot_response", chatbot.generate_chatbot_response, queries, 1, True),
+        ("get_chatbot_responses", lambda batch: list(chatbot.get_chatbot_responses(batch)), batches, messages_per_batch, True),
+        ("find_nearby_clinics", chatbot.find_nearby_clinics, locations, 1, True),
+        ("flask_chat", chat, queries, 1, True),
+        # Same /chat requests again with the caches warm from the previous pass
+        ("flask_chat_cached", chat, queries, 1, False),
+        ("flask_chat_batch", lambda batch: client.post("/chat/batch", json={"messages": batch}).get_data(), batches, messages_per_batch, True),
+        ("flask_find_clinics", lambda payload: client.post("/find-clinics", json=payload), locations, 1, True),
+    ]
+    results["stages"] = {}
+    for name, fn, inputs, items_per_op, cold in stages:
+        results["stages"][name] = measure(fn, inputs, items_per_op=items_per_op, reset=clear_caches if cold else None)
+
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return results
+
+# Read expanded_knowledge and the medical_responses keywords out of app.py
+def built_in_texts():
+    import ast
+    with open(os.path.join(REPO_ROOT, "app.py"), 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            if node.targets[0].id in ("expanded_knowledge", "medical_responses"):
+                values[node.targets[0].id] = ast.literal_eval(node.value)
+    return list(values["expanded_knowledge"]), list(values["medical_responses"])
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Print the p50/p95 change of every stage against an earlier results file
+def compare(previous, current):
+    for scale, scale_results in current["scales"].items():
+        previous_stages = previous.get("scales", {}).get(scale, {}).get("stages", {})
+        print(f"scale {scale}x")
+        if not previous_stages:
+            print("  not in the earlier results")
+        for stage, stats in scale_results["stages"].items():
+            if stage not in previous_stages:
+                continue
+            changes = []
+            for metric in ("p50_ms", "p95_ms"):
+                before, after = previous_stages[stage][metric], stats[metric]
+                change = 100.0 * (after - before) / before if before else 0.0
+                changes.append(f"{metric} {before:.3f} -> {after:.3f} ({change:+.1f}%)")
+            print(f"  {stage:<26s} " + "  ".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chat and clinic-finder hot paths.")
+    parser.add_argument("--scales", default="1,10,100,1000", help="Comma-separated knowledge base and clinic table multipliers.")
+    parser.add_argument("--queries", type=int, default=200, help="Synthetic chat and clinic queries per stage.")
+    parser.add_argument("--corpus", help="JSONL query corpus added to the synthetic queries.")
+    parser.add_argument("--model", help="Model name or directory to load instead of the tiny stand-in.")
+    parser.add_argument("--workdir", help="Directory for the generated data. Defaults to a temporary directory.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--compare", help="Earlier results file to compare against.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--inputs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        with open(args.inputs, 'r', encoding='utf-8') as f:
+            inputs = json.load(f)
+        results = run_scale(args.worker, inputs["queries"], inputs["locations"])
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f)
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="aar-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    rng = random.Random(args.seed)
+
+    # The built-in texts come from app.py without importing it, which would load a model
+    sys.path.insert(0, REPO_ROOT)
+    knowledge_texts, keywords = built_in_texts()
+
+    model = args.model
+    if model is None:
+        model = os.path.join(workdir, "stand_in_model")
+        write_stand_in_model(model, knowledge_texts + keywords + [QUERY_TEMPLATES[0]])
+
+    queries = synthetic_queries(args.queries, keywords, knowledge_texts, rng)
+    if args.corpus:
+        queries += load_corpus(args.corpus)
+    inputs_file = os.path.join(workdir, "inputs.json")
+    with open(inputs_file, 'w', encoding='utf-8') as f:
+        json.dump({"queries": queries, "locations": synthetic_locations(args.queries, rng)}, f)
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model or "stand-in",
+            "queries": len(queries),
+        },
+        "scales": {},
+    }
+
+    for scale in (int(value) for value in args.scales.split(",")):
+        scale_dir = os.path.join(workdir, f"scale_{scale}")
+        os.makedirs(scale_dir, exist_ok=True)
+        knowledge_source = os.path.join(scale_dir, "knowledge.jsonl")
+        with open(knowledge_source, 'w', encoding='utf-8') as f:
+            for text in scaled_knowledge(knowledge_texts, scale, random.Random(args.seed)):
+                f.write(json.dumps({"text": text}) + "\n")
+        database = os.path.join(scale_dir, "clinics.db")
+        if os.path.exists(database):
+            os.remove(database)
+        write_scaled_clinics(os.path.join(REPO_ROOT, "aar_clinics.db"), database, scale, random.Random(args.seed))
+
+        env = dict(
+            os.environ,
+            EMBEDDING_MODEL=model,
+            EMBEDDING_BACKEND="torch",
+            KNOWLEDGE_PATH=os.path.join(scale_dir, "knowledge"),
+            DATABASE_PATH=database,
+            CACHE_DB_PATH="",
+            BENCH_KNOWLEDGE_SOURCE=knowledge_source,
+        )
+        if args.model is None:
+            env["HF_HUB_OFFLINE"] = "1"
+        result_file = os.path.join(scale_dir, "result.json")
+        log_file = os.path.join(scale_dir, "worker.log")
+        print(f"Running scale {scale}x (log: {log_file})")
+        with open(log_file, 'w') as log:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", str(scale), "--inputs", inputs_file, "--output", result_file],
+                env=env, stdout=log, stderr=subprocess.STDOUT, check=True,
+            )
+        with open(result_file, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+        output["scales"][str(scale)] = results
+
+        print(f"  {results['knowledge_chunks']} knowledge chunks, {results['clinics']} clinics, peak RSS {results['peak_rss_mb']:.0f}MB")
+        for stage, stats in results["stages"].items():
+            print(f"  {stage:<26s} p50 {stats['p50_ms']:8.3f}ms  p95 {stats['p95_ms']:8.3f}ms  "
+                  f"p99 {stats['p99_ms']:8.3f}ms  {stats['throughput_per_s']:9.1f}/s")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# Gunicorn settings for the AAR chatbot: `gunicorn app:app`
+import os
+import sys
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# PRELOAD_MODEL=true imports app.py, and so loads and warms up BioBERT, once in
+# the master before forking. Workers then share the model weights copy-on-write
+# instead of each loading a private copy. Without it each worker loads the model
+# on a background thread after boot. The knowledge index is memory-mapped and
+# shared through the OS page cache either way.
+preload_app = os.getenv('PRELOAD_MODEL', 'False').lower() == 'true'
+
+def post_fork(server, worker):
+    # With preload the app module is already imported here, so this is the
+    # worker's memory before it has touched anything of its own
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        server.log.info("Worker %s forked, memory: %s", worker.pid,
+                        app_module.format_memory(app_module.process_memory_mb()))
+
+def post_worker_init(worker):
+    from app import process_memory_mb, format_memory, init_app_state
+    # Load the app state and start loading the model before the first request
+    init_app_state()
+    worker.log.info("Worker %s loaded the app, memory: %s", worker.pid, format_memory(process_memory_mb()))
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# app.py reads its configuration when it is imported; keep the tests away from
+# the repository's clinics database and knowledge index
+os.environ.setdefault("DATABASE_PATH", os.path.join(os.path.dirname(__file__), "missing.db"))
+os.environ.setdefault("KNOWLEDGE_PATH", os.path.join(os.path.dirname(__file__), "missing_knowledge"))
+os.environ.setdefault("CACHE_DB_PATH", "")
+os.environ.setdefault("KNOWLEDGE_REFRESH_SECONDS", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
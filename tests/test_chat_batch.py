@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+import app
+
+# Stand-in for the model path that reads the whole batch before answering,
+# like a chunk of get_chatbot_responses does
+def buffered_responses(messages):
+    messages = list(messages)
+    for message in messages:
+        yield f"answer to {message}"
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app, "app_state", object())
+    monkeypatch.setattr(app, "refresh_app_state", lambda: None)
+    monkeypatch.setattr(app, "get_chatbot_responses", buffered_responses)
+    return app.app.test_client()
+
+def read_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_json_batch(client):
+    response = client.post("/chat/batch", json={"messages": ["fever", {"message": "cough"}]})
+    assert response.status_code == 200
+    assert read_lines(response) == [
+        {"index": 0, "response": "answer to fever"},
+        {"index": 1, "response": "answer to cough"},
+    ]
+
+def test_malformed_items_get_their_own_error_line(client):
+    body = "\n".join(['"fever"', '{"message": "cough"}', '[1]', '{"message": 5}', 'not json', '"headache"', '{}']) + "\n"
+    response = client.post("/chat/batch", data=body, content_type="application/x-ndjson")
+    lines = read_lines(response)
+    assert [line["index"] for line in lines] == list(range(7))
+    assert [line.get("response") for line in lines] == ["answer to fever", "answer to cough", None, None, None, "answer to headache", None]
+    assert all(line["error"] == app.INVALID_BATCH_MESSAGE for line in lines if "response" not in line)
+
+def test_malformed_json_items(client):
+    lines = read_lines(client.post("/chat/batch", json={"messages": [5, "fever", None]}))
+    assert lines == [
+        {"index": 0, "error": app.INVALID_BATCH_MESSAGE},
+        {"index": 1, "response": "answer to fever"},
+        {"index": 2, "error": app.INVALID_BATCH_MESSAGE},
+    ]
+
+@pytest.mark.parametrize("body", [{"messages": "abc"}, {"message": "fever"}, ["fever"]])
+def test_messages_must_be_a_list(client, body):
+    response = client.post("/chat/batch", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
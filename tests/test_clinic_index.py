@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+import pytest
+
+import app
+
+def random_clinics(count, seed=0, lat_range=(-90.0, 90.0), lng_range=(-180.0, 180.0)):
+    rng = random.Random(seed)
+    return [
+        app.Clinic(i, f"Clinic {i}", f"Street {i}", rng.uniform(*lat_range), rng.uniform(*lng_range), "")
+        for i in range(count)
+    ]
+
+def brute_force(clinics, lat, lng):
+    distances = app.haversine_distances(lat, lng, [c.lat for c in clinics], [c.lng for c in clinics])
+    return sorted(zip(distances, [c.id for c in clinics]))
+
+def ids(results):
+    return [clinic.id for clinic, _ in results]
+
+def test_haversine_known_distance():
+    # Nairobi to Mombasa
+    distance = app.haversine_distances(-1.286389, 36.817223, [-4.043477], [39.668206])[0]
+    assert distance == pytest.approx(440.0, rel=0.01)
+
+@pytest.mark.parametrize("lat, lng", [
+    (-1.29, 36.82), (0.0, 179.9), (0.0, -179.9), (89.5, 10.0), (-89.9, -120.0), (45.0, 0.0),
+])
+def test_nearest_matches_brute_force(lat, lng):
+    clinics = random_clinics(500)
+    index = app.ClinicIndex(clinics, cell_degrees=2.0)
+    expected = brute_force(clinics, lat, lng)[:10]
+    results = index.nearest(lat, lng, 10)
+    assert ids(results) == [clinic_id for _, clinic_id in expected]
+    assert [d for _, d in results] == pytest.approx([d for d, _ in expected])
+
+def test_nearest_in_dense_region():
+    clinics = random_clinics(300, lat_range=(-5.0, 5.0), lng_range=(33.0, 42.0))
+    index = app.ClinicIndex(clinics, cell_degrees=0.5)
+    for lat, lng in [(-1.29, 36.82), (30.0, 36.0), (-4.9, 41.9)]:
+        expected = brute_force(clinics, lat, lng)[:5]
+        assert ids(index.nearest(lat, lng, 5)) == [clinic_id for _, clinic_id in expected]
+
+@pytest.mark.parametrize("lat, lng, max_km", [
+    (-1.29, 36.82, 2000.0), (0.0, 179.5, 1500.0), (88.0, 0.0, 800.0), (10.0, 10.0, 0.5),
+])
+def test_within_matches_brute_force(lat, lng, max_km):
+    clinics = random_clinics(2000, seed=1)
+    index = app.ClinicIndex(clinics, cell_degrees=1.0)
+    expected = [clinic_id for d, clinic_id in brute_force(clinics, lat, lng) if d <= max_km]
+    assert ids(index.within(lat, lng, max_km)) == expected
+
+def test_nearest_with_max_km_is_capped():
+    clinics = random_clinics(2000, seed=1)
+    index = app.ClinicIndex(clinics, cell_degrees=1.0)
+    results = index.nearest(-1.29, 36.82, 3, max_km=2000.0)
+    assert ids(results) == ids(index.within(-1.29, 36.82, 2000.0))[:3]
+
+def test_small_and_empty_indexes():
+    assert app.ClinicIndex([]).nearest(0.0, 0.0, 5) == []
+    assert app.ClinicIndex([]).within(0.0, 0.0, 100.0) == []
+    clinics = random_clinics(3)
+    index = app.ClinicIndex(clinics)
+    assert sorted(ids(index.nearest(0.0, 0.0, 10))) == [0, 1, 2]
+    assert index.within(0.0, 0.0, 0.0) == []
+    assert np.all(np.diff([d for _, d in index.nearest(0.0, 0.0, 10)]) >= 0)
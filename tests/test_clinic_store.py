@@ -0,0 +1,83 @@
+import sqlite3
+import threading
+
+import pytest
+
+import app
+
+CLINICS = [
+    (2, "AAR Hospital Kisumu", "Oginga Odinga Street, Kisumu", -0.091702, 34.756057, "+254 709 071 100"),
+    (1, "AAR Healthcare Nairobi", "Kiambere Road, Upper Hill, Nairobi", -1.298357, 36.818359, "+254 709 071 000"),
+]
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "clinics.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE clinics (id INTEGER PRIMARY KEY, name TEXT NOT NULL, address TEXT NOT NULL, "
+                 "lat REAL NOT NULL, lng REAL NOT NULL, phone TEXT NOT NULL)")
+    conn.executemany("INSERT INTO clinics VALUES (?, ?, ?, ?, ?, ?)", CLINICS)
+    conn.commit()
+    conn.close()
+    return path
+
+@pytest.fixture
+def store(db_path):
+    store = app.ClinicStore(db_path)
+    yield store
+    store.close()
+
+def test_all_returns_clinics_in_id_order(store):
+    clinics = store.all()
+    assert [clinic.id for clinic in clinics] == [1, 2]
+    assert clinics[0].to_dict() == dict(zip(app.Clinic.__slots__, CLINICS[1]))
+
+def test_connection_is_read_only(store):
+    store.all()
+    with pytest.raises(sqlite3.OperationalError):
+        store._connection().execute("DELETE FROM clinics")
+
+def test_connection_is_reused_per_thread(store):
+    conn = store._connection()
+    assert store._connection() is conn
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(store._connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+def test_sees_rows_written_after_opening(store, db_path):
+    assert len(store.all()) == 2
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO clinics VALUES (3, 'AAR Healthcare Mombasa', 'Moi Avenue, Mombasa', -4.042605, 39.669025, '+254 709 071 200')")
+    conn.commit()
+    conn.close()
+    assert [clinic.id for clinic in store.all()] == [1, 2, 3]
+
+def test_setup_database_is_idempotent(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DATABASE_PATH", str(tmp_path / "aar_clinics.db"))
+    app.setup_database()
+    store = app.ClinicStore(app.DATABASE_PATH)
+    first = [clinic.to_dict() for clinic in store.all()]
+    app.setup_database()
+    assert [clinic.to_dict() for clinic in store.all()] == first
+    assert first
+    store.close()
+
+def test_get_by_id(store):
+    assert store.get(2).name == "AAR Hospital Kisumu"
+    assert store.get(99) is None
+
+def test_in_bbox(store):
+    assert [clinic.id for clinic in store.in_bbox(-2.0, 0.0, 34.0, 37.0)] == [1, 2]
+    assert [clinic.id for clinic in store.in_bbox(-0.5, 0.0, 34.0, 35.0)] == [2]
+    assert store.in_bbox(10.0, 11.0, 10.0, 11.0) == []
+
+def test_in_bbox_uses_lat_lng_index(store, db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE INDEX idx_clinics_lat_lng ON clinics (lat, lng)")
+    conn.commit()
+    conn.close()
+    plan = store._connection().execute("EXPLAIN QUERY PLAN " + store.SELECT_CLINICS + " WHERE lat BETWEEN ? AND ? AND lng BETWEEN ? AND ? ORDER BY id", (0, 1, 0, 1)).fetchall()
+    assert any("idx_clinics_lat_lng" in row[-1] for row in plan)
@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+def test_lone_request_does_not_wait():
+    batcher = app.EmbeddingBatcher(lambda texts: [len(text) for text in texts], 16, 5000)
+    started = time.perf_counter()
+    assert batcher.submit("fever").result(timeout=5) == 5
+    assert time.perf_counter() - started < 1.0
+
+def test_pending_requests_are_batched():
+    release = threading.Event()
+    batches = []
+
+    def embed(texts):
+        batches.append(len(texts))
+        release.wait(5)
+        return list(texts)
+
+    batcher = app.EmbeddingBatcher(embed, 4, 50)
+    first = batcher.submit("first")
+    while not batches:
+        time.sleep(0.001)
+    # Queued while the first batch runs, so they go together, at most 4 at a time
+    futures = [batcher.submit(f"text {i}") for i in range(6)]
+    release.set()
+    assert first.result(timeout=5) == "first"
+    assert [future.result(timeout=5) for future in futures] == [f"text {i}" for i in range(6)]
+    assert batches == [1, 4, 2]
+    assert batcher.stats()["items"] == 7
+
+def test_errors_reach_every_caller_in_the_batch():
+    def embed(texts):
+        raise ValueError("model failed")
+
+    batcher = app.EmbeddingBatcher(embed, 4, 0)
+    futures = [batcher.submit("fever"), batcher.submit("cough")]
+    for future in futures:
+        with pytest.raises(ValueError, match="model failed"):
+            future.result(timeout=5)
@@ -0,0 +1,93 @@
+import numpy as np
+
+import app
+
+def clustered_embeddings(num_rows=2000, dim=16, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    rows = centers[rng.integers(clusters, size=num_rows)] + 0.3 * rng.standard_normal((num_rows, dim))
+    return app.RetrievalEngine.normalize(rows)
+
+# Queries near the indexed rows, as real questions are near knowledge chunks
+def nearby_queries(embeddings, num_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = embeddings[rng.choice(len(embeddings), num_queries, replace=False)]
+    return rows + 0.1 * rng.standard_normal(rows.shape)
+
+def build(embeddings, nlist=16, **kwargs):
+    centroids, list_offsets, list_rows = app.IVFIndex.train(embeddings, nlist, **kwargs)
+    return app.IVFIndex(embeddings, centroids, list_offsets, list_rows)
+
+def test_train_assigns_every_row_once():
+    embeddings = clustered_embeddings()
+    centroids, list_offsets, list_rows = app.IVFIndex.train(embeddings, 16)
+    assert centroids.shape == (16, embeddings.shape[1])
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1.0, atol=1e-5)
+    assert list_offsets[0] == 0 and list_offsets[-1] == len(embeddings)
+    assert np.all(np.diff(list_offsets) >= 0)
+    assert np.array_equal(np.sort(list_rows), np.arange(len(embeddings)))
+    # Each row sits in the list of its closest centroid
+    for list_id in range(16):
+        rows = list_rows[list_offsets[list_id]:list_offsets[list_id + 1]]
+        assert np.all(app.IVFIndex.assign(embeddings[rows], centroids) == list_id)
+
+def test_train_caps_nlist_at_row_count():
+    embeddings = clustered_embeddings(num_rows=5)
+    centroids, list_offsets, list_rows = app.IVFIndex.train(embeddings, 16)
+    assert len(centroids) == 5
+    assert list_offsets[-1] == 5
+
+def test_train_assigns_in_bounded_blocks(monkeypatch):
+    embeddings = clustered_embeddings()
+    monkeypatch.setattr(app.RetrievalEngine, "MAX_SCORES_PER_BLOCK", 16 * 100)
+    sizes = []
+    assign = app.IVFIndex.assign
+    monkeypatch.setattr(app.IVFIndex, "assign", staticmethod(lambda rows, centroids: sizes.append(len(rows)) or assign(rows, centroids)))
+    expected = app.IVFIndex.train(embeddings, 16, sample_size=500)
+    assert max(sizes) == 100
+
+    monkeypatch.undo()
+    for actual, wanted in zip(app.IVFIndex.train(embeddings, 16, sample_size=500), expected):
+        assert np.allclose(actual, wanted)
+
+def test_probing_every_list_is_exact():
+    embeddings = clustered_embeddings()
+    index = build(embeddings)
+    queries = nearby_queries(embeddings, 20)
+    exact_indices, exact_scores = app.RetrievalEngine(embeddings, normalized=True).search_batch(queries, 10)
+    indices, scores = index.search_batch(queries, 10, nprobe=16)
+    assert np.array_equal(indices, exact_indices)
+    assert np.allclose(scores, exact_scores, atol=1e-5)
+
+def test_recall_with_few_probes():
+    embeddings = clustered_embeddings()
+    index = build(embeddings)
+    queries = nearby_queries(embeddings, 50)
+    exact_indices, _ = app.RetrievalEngine(embeddings, normalized=True).search_batch(queries, 10)
+    indices, _ = index.search_batch(queries, 10, nprobe=2)
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(indices, exact_indices)])
+    assert recall >= 0.9
+
+def test_returns_k_results_when_probed_lists_are_small():
+    embeddings = clustered_embeddings(num_rows=200)
+    index = build(embeddings, nlist=50)
+    indices, scores = index.search(embeddings[0], 40, nprobe=1)
+    assert len(indices) == 40 and len(set(indices)) == 40
+    assert indices[0] == 0
+    assert np.all(np.diff(scores) <= 0)
+
+def test_deleted_rows_are_skipped():
+    embeddings = clustered_embeddings(num_rows=300)
+    index = build(embeddings, nlist=30)
+    deleted = np.zeros(len(embeddings), dtype=bool)
+    deleted[::3] = True
+    queries = nearby_queries(embeddings, 10)
+    indices, scores = index.search_batch(queries, 20, nprobe=30, deleted=deleted)
+    exact_indices, exact_scores = app.RetrievalEngine(embeddings, normalized=True).search_batch(queries, 20, deleted=deleted)
+    assert not deleted[indices].any()
+    assert np.array_equal(indices, exact_indices)
+    assert np.allclose(scores, exact_scores, atol=1e-5)
+
+    # Short probed lists are topped up with live rows from the next ones
+    indices, _ = index.search_batch(queries, 20, nprobe=1, deleted=deleted)
+    assert indices.shape == (10, 20) and not deleted[indices].any()
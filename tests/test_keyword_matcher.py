@@ -0,0 +1,53 @@
+import random
+import re
+
+import app
+
+# Reference implementation: every keyword occurrence that starts at a word
+# boundary and ends at one, optionally after an inflection suffix
+def naive_find_all(keywords, text):
+    text = text.lower()
+    suffixes = "|".join(app.KeywordMatcher.INFLECTION_SUFFIXES)
+    hits = set()
+    for keyword in keywords:
+        pattern = re.compile(rf"(?<![^\W_])(?=({re.escape(keyword.lower())})(?:{suffixes})?(?![^\W_]))")
+        for match in pattern.finditer(text):
+            hits.add((match.start(1), match.end(1), keyword))
+    return hits
+
+def test_matches_whole_words_only():
+    matcher = app.KeywordMatcher(["flu", "cold"])
+    assert list(matcher.find_all("Is influenza a cold?")) == [(15, 19, "cold")]
+    assert matcher.best_match("scolding") is None
+
+def test_accepts_inflections():
+    matcher = app.KeywordMatcher(["headache", "cough"])
+    assert matcher.best_match("I keep getting headaches") == "headache"
+    assert matcher.best_match("Coughing all night") == "cough"
+    assert matcher.best_match("coughers") is None
+
+def test_best_match_prefers_longest_then_earliest():
+    matcher = app.KeywordMatcher(["pain", "chest pain", "fever"])
+    assert matcher.best_match("chest pain and fever") == "chest pain"
+    assert matcher.best_match("fever with pain") == "fever"
+
+def test_overlapping_keywords_via_failure_links():
+    matcher = app.KeywordMatcher(["he", "she", "hers", "his"])
+    assert set(matcher.find_all("she said hers, not his or he")) == {
+        (0, 3, "she"), (9, 13, "hers"), (19, 22, "his"), (26, 28, "he"),
+    }
+
+def test_matches_brute_force_on_random_text():
+    rng = random.Random(0)
+    alphabet = "abc"
+    keywords = sorted({"".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(30)})
+    matcher = app.KeywordMatcher(keywords)
+    for _ in range(200):
+        words = ["".join(rng.choice(alphabet + "egins") for _ in range(rng.randint(1, 7))) for _ in range(rng.randint(1, 6))]
+        text = rng.choice([" ", ", ", "-"]).join(words)
+        assert set(matcher.find_all(text)) == naive_find_all(keywords, text), text
+
+def test_empty_keyword_list():
+    matcher = app.KeywordMatcher([])
+    assert list(matcher.find_all("anything")) == []
+    assert matcher.best_match("anything") is None
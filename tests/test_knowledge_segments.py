@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+import click
+import numpy as np
+import pytest
+
+import app
+
+DIM = 8
+
+TEXTS = [f"Knowledge chunk number {i} about condition {i}." for i in range(20)]
+
+# Deterministic stand-in for the model: every text gets its own random vector
+def fake_embed_batch(texts, backend=None, **kwargs):
+    return np.stack([
+        np.random.default_rng(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)).standard_normal(DIM)
+        for text in texts
+    ]).astype(np.float32)
+
+def write_source(path, texts):
+    with open(path, 'w', encoding='utf-8') as f:
+        for text in texts:
+            f.write(json.dumps({"text": text}) + "\n")
+    return str(path)
+
+@pytest.fixture
+def knowledge(tmp_path, monkeypatch):
+    knowledge_path = str(tmp_path / "knowledge")
+    monkeypatch.setattr(app, "KNOWLEDGE_PATH", knowledge_path)
+    monkeypatch.setattr(app, "load_model", lambda: None)
+    monkeypatch.setattr(app, "biobert_model", SimpleNamespace(config=SimpleNamespace(hidden_size=DIM)))
+    monkeypatch.setattr(app, "model_dim", lambda: DIM)
+    monkeypatch.setattr(app, "embed_batch", fake_embed_batch)
+    app.build_knowledge_index(write_source(tmp_path / "source.jsonl", TEXTS), batch_size=8)
+    return knowledge_path
+
+def live_texts(state):
+    return sorted(state["knowledge_texts"])
+
+# Every live text, best match first, for the embedding of query_text
+def search(state, query_text):
+    indices, scores = state["knowledge_index"].search(fake_embed_batch([query_text])[0], len(TEXTS) * 2)
+    return [state["knowledge_texts"][int(i)] for i in indices], scores
+
+def test_build_and_load(knowledge):
+    state = app.load_knowledge()
+    assert isinstance(state["knowledge_index"], app.RetrievalEngine)
+    assert list(state["knowledge_texts"]) == TEXTS
+    assert search(state, TEXTS[3])[0][0] == TEXTS[3]
+    assert state["knowledge_generation"] == 1
+
+def test_update_adds_and_deletes_in_a_segment(knowledge):
+    added = ["A brand new chunk about malaria.", "Another new chunk about typhoid."]
+    generation = app.update_knowledge(added, [app.text_hash(TEXTS[0]), app.text_hash(TEXTS[5])])
+    assert generation == 2
+    assert os.path.isdir(app.knowledge_segment_path("segment-000002"))
+
+    state = app.load_knowledge()
+    expected = sorted(set(TEXTS) - {TEXTS[0], TEXTS[5]} | set(added))
+    assert live_texts(state) == expected
+    assert len(state["knowledge_texts"]) == len(expected)
+    assert len(state["knowledge_parts"]) == 2
+
+    found, scores = search(state, added[0])
+    assert found[0] == added[0]
+    assert sorted(found) == expected
+    assert np.all(np.diff(scores) <= 0)
+    assert TEXTS[0] not in search(state, TEXTS[0])[0]
+
+def test_segmented_index_matches_exact_search_over_live_rows():
+    rng = np.random.default_rng(0)
+    parts = [rng.standard_normal((n, DIM)).astype(np.float32) for n in (50, 10, 0, 5)]
+    deleted = [[0, 3, 49], [2], [], [0, 1, 2, 3, 4]]
+    index = app.SegmentedIndex((app.RetrievalEngine(part), rows) for part, rows in zip(parts, deleted))
+    live = np.concatenate([np.delete(np.arange(len(part)), rows) + start
+                           for part, rows, start in zip(parts, deleted, np.cumsum([0, 50, 10, 0]))])
+    assert index.live_count == len(live)
+
+    queries = rng.standard_normal((4, DIM))
+    exact_indices, exact_scores = app.RetrievalEngine(np.concatenate(parts)[live]).search_batch(queries, 8)
+    indices, scores = index.search_batch(queries, 8)
+    assert np.array_equal(indices, live[exact_indices])
+    assert np.allclose(scores, exact_scores, atol=1e-5)
+    assert index.search_batch(queries, 1000)[0].shape == (4, len(live))
+
+def test_update_without_changes_is_a_no_op(knowledge):
+    assert app.update_knowledge([TEXTS[1]], [app.text_hash("not in the index")]) is None
+    assert app.load_knowledge()["knowledge_generation"] == 1
+
+def test_replace_and_sync(knowledge, tmp_path):
+    app.replace_knowledge_chunk(app.text_hash(TEXTS[2]), "Chunk two, rewritten.")
+    state = app.load_knowledge()
+    assert "Chunk two, rewritten." in live_texts(state) and TEXTS[2] not in live_texts(state)
+
+    wanted = TEXTS[:10] + ["A chunk only in the new source."]
+    app.sync_knowledge(write_source(tmp_path / "new_source.jsonl", wanted))
+    assert live_texts(app.load_knowledge()) == sorted(wanted)
+
+def test_compaction_keeps_live_rows_and_results(knowledge):
+    app.update_knowledge(["First added chunk."], [app.text_hash(TEXTS[4])])
+    app.update_knowledge(["Second added chunk."], [app.text_hash("First added chunk."), app.text_hash(TEXTS[7])])
+    before = app.load_knowledge()
+
+    app.compact_knowledge_index()
+    after = app.load_knowledge()
+    assert len(after["knowledge_parts"]) == 1
+    assert isinstance(after["knowledge_index"], app.RetrievalEngine)
+    assert live_texts(after) == live_texts(before)
+    assert not os.path.exists(app.knowledge_file_path(app.KNOWLEDGE_SEGMENTS_DIR))
+    for query in [TEXTS[1], "Second added chunk.", "something else entirely"]:
+        found_before, scores_before = search(before, query)
+        found_after, scores_after = search(after, query)
+        assert found_after == found_before
+        assert np.allclose(scores_after, scores_before)
+
+def test_updates_compact_automatically(knowledge, monkeypatch):
+    monkeypatch.setattr(app, "KNOWLEDGE_MAX_SEGMENTS", 3)
+    app.update_knowledge(["Added chunk 1."])
+    app.update_knowledge(["Added chunk 2."])
+    assert len(app.load_knowledge_segments()["segments"]) == 2
+    app.update_knowledge(["Added chunk 3."])
+    assert app.load_knowledge_segments()["segments"] == []
+    assert len(app.load_knowledge()["knowledge_texts"]) == len(TEXTS) + 3
+
+    # Deleting over a fifth of the rows compacts too
+    app.update_knowledge(delete_hashes=[app.text_hash(text) for text in TEXTS[:6]])
+    assert app.load_knowledge_segments()["segments"] == []
+    assert app.load_knowledge_manifest()["count"] == len(TEXTS) - 3
+
+def test_reload_reuses_open_parts(knowledge):
+    app.update_knowledge(["Added chunk 1."])
+    first = app.load_knowledge()
+    app.update_knowledge(["Added chunk 2."])
+    second = app.load_knowledge(SimpleNamespace(**first))
+    assert second["knowledge_parts"][0] is first["knowledge_parts"][0]
+    assert second["knowledge_parts"][1] is first["knowledge_parts"][1]
+    assert len(second["knowledge_parts"]) == 3
+
+def test_dimension_mismatch_is_refused(knowledge, monkeypatch):
+    monkeypatch.setattr(app, "model_dim", lambda: DIM * 2)
+    with pytest.raises(RuntimeError):
+        app.load_knowledge()
+    with pytest.raises(click.ClickException):
+        app.update_knowledge(["Added chunk."])
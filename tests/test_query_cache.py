@@ -0,0 +1,57 @@
+import sqlite3
+
+import app
+
+def make_cache(tmp_path, **kwargs):
+    return app.QueryCache("test", 16, 60, str(tmp_path / "cache.db"), **kwargs)
+
+def disk_rows(cache):
+    conn = sqlite3.connect(cache.db_path)
+    try:
+        return conn.execute("SELECT key, version FROM query_cache_entries ORDER BY key, version").fetchall()
+    finally:
+        conn.close()
+
+def test_memory_tier_checks_version():
+    cache = app.QueryCache("test", 16, 60)
+    cache.set("Fever ", "v1", "answer")
+    assert cache.get("fever", "v1") == "answer"
+    assert cache.get("fever", "v2") is None
+
+def test_disk_tier_is_shared_between_instances(tmp_path):
+    make_cache(tmp_path).set("fever", "v1", "answer")
+    other = make_cache(tmp_path)
+    assert other.get("fever", "v1") == "answer"
+    assert other.disk_hits == 1
+
+def test_local_only_skips_the_disk_tier(tmp_path):
+    make_cache(tmp_path).set("fever", "v1", "answer")
+    other = make_cache(tmp_path)
+    assert other.get("fever", "v1", local_only=True) is None
+    assert other.get("fever", "v1") == "answer"
+    assert other.get("fever", "v1", local_only=True) == "answer"
+
+def test_versions_coexist_on_disk(tmp_path):
+    old, new = make_cache(tmp_path), make_cache(tmp_path)
+    old.set("fever", "v1", "old answer")
+    new.set("fever", "v2", "new answer")
+    assert make_cache(tmp_path).get("fever", "v1") == "old answer"
+    assert make_cache(tmp_path).get("fever", "v2") == "new answer"
+
+def test_invalidate_only_deletes_its_version(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("fever", "v1", "old answer")
+    cache.set("fever", "v2", "new answer")
+    cache.invalidate()
+    assert disk_rows(cache) == [("fever", "v1"), ("fever", "v2")]
+    cache.invalidate("v1")
+    assert disk_rows(cache) == [("fever", "v2")]
+
+def test_writes_prune_expired_and_excess_rows(tmp_path):
+    cache = make_cache(tmp_path, max_db_rows=3, prune_every=1)
+    cache.ttl = -1
+    cache.set("expired", "v1", "answer")
+    cache.ttl = 60
+    for i in range(5):
+        cache.set(f"query {i}", "v1", "answer")
+    assert [key for key, _ in disk_rows(cache)] == ["query 2", "query 3", "query 4"]